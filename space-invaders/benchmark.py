@@ -0,0 +1,392 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks for the Space Invaders environment, replay memory and agents.
+
+Games are seeded and replay fixed action traces, so the scores reported
+with the timings must match between versions unless the game changed.
+
+Run from this folder:
+    python benchmark.py
+    python benchmark.py --output new.json --baseline old.json
+
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, Sequence
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import cv2
+import numpy as np
+import pygame
+
+XRES, YRES = 800, 600
+XRES_SCALED, YRES_SCALED = 100, 75
+TICKS_REF = 80
+SEED = 0
+RESULTS_FILE = "benchmark.json"
+NOTEBOOKS = ("main_1.ipynb", "main_2.ipynb")  # DDRQN and DDTQN agents
+SCREEN = pygame.display.set_mode((XRES, YRES))
+
+from game_v2 import BLOCKERS_POSITION, SpaceInvaders, collide_sprites  # noqa: E402 (needs the display)
+from inference import InferenceServer  # noqa: E402
+from replay_buffer import PrioritizedReplayBuffer  # noqa: E402
+
+
+def legacy_get_state(game: SpaceInvaders) -> np.ndarray:
+    """Observation pipeline before the zero-copy get_state, kept as reference."""
+    state = np.array(pygame.surfarray.array3d(game.screen))
+    state = np.transpose(state, (1, 0, 2))
+    state = cv2.cvtColor(state, cv2.COLOR_RGB2BGR)
+    state = cv2.resize(state, (game.state_xres, game.state_yres), interpolation=cv2.INTER_CUBIC)
+    state = state / 255.0
+    state = np.transpose(state, (2, 0, 1)).astype(np.float32)
+    return state
+
+
+def time_per_call(fn: Callable, repeats: int) -> float:
+    """Returns mean seconds per call of `fn`."""
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident memory of this process so far in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def action_trace(steps: int, seed: int = SEED) -> np.ndarray:
+    """Returns a fixed sequence of random actions, firing every other step on average."""
+    return np.random.RandomState(seed).choice(4, size=steps, p=[0.1, 0.5, 0.2, 0.2])
+
+
+def make_game(seed: int = SEED, **kwargs) -> SpaceInvaders:
+    """Returns a seeded game a few steps into the first round."""
+    game = SpaceInvaders(SCREEN, None, XRES_SCALED, YRES_SCALED, TICKS_REF, seed=seed, **kwargs)
+    game.new_game()
+    for i in range(30):
+        game.step(action=1 if i % 4 == 0 else 3)
+    game.get_state()
+    return game
+
+
+def play_trace(game: SpaceInvaders, trace: Sequence[int], **step_kwargs) -> int:
+    """Play `trace` from a new game, returns the sum of the final scores."""
+    game.new_game()
+    total = 0
+    for action in trace:
+        _, _, done = game.step(action=int(action), **step_kwargs)
+        if done:
+            total += game.score
+            game.new_game()
+    return total + game.score
+
+
+def bench_env(steps: int = 3000, seed: int = SEED) -> Dict[str, Dict[str, float]]:
+    """Returns steps per second and trace score for each way of stepping the game."""
+    trace = action_trace(steps, seed)
+    modes = {
+        "render": (dict(headless=False), dict(observe=False)),
+        "headless": (dict(headless=True), dict(observe=False)),
+        "headless_observe": (dict(headless=True), dict(observe=True)),
+        "frame_skip_3": (dict(headless=True), dict(repeat=3, observe=True)),
+    }
+    results = {}
+    for name, (game_kwargs, step_kwargs) in modes.items():
+        game = SpaceInvaders(SCREEN, None, XRES_SCALED, YRES_SCALED, TICKS_REF, seed=seed, **game_kwargs)
+        start = time.perf_counter()
+        score = play_trace(game, trace, **step_kwargs)
+        seconds = time.perf_counter() - start
+        results[name] = dict(steps_per_sec=steps / seconds, score=score)
+    return results
+
+
+def bench_get_state(repeats: int = 200) -> Dict[str, float]:
+    """Returns microseconds per observation for each get_state variant."""
+    game = make_game()
+    assert np.array_equal(legacy_get_state(game), game.get_state())
+    out = np.empty((3, YRES_SCALED, XRES_SCALED), dtype=np.float32)
+    results = {
+        "legacy": time_per_call(lambda: legacy_get_state(game), repeats),
+        "float32": time_per_call(game.get_state, repeats),
+        "float32_out": time_per_call(lambda: game.get_state(out=out), repeats),
+    }
+    variants = {
+        "uint8": dict(state_dtype=np.uint8),
+        "uint8_gray": dict(state_dtype=np.uint8, state_grayscale=True),
+        "uint8_gray_crop": dict(state_dtype=np.uint8, state_grayscale=True,
+                                state_crop=(30, YRES, 0, XRES)),
+    }
+    for name, kwargs in variants.items():
+        game = make_game(**kwargs)
+        results[name] = time_per_call(game.get_state, repeats)
+    return {name: seconds * 1e6 for name, seconds in results.items()}
+
+
+def bench_collisions(steps: int = 3000, repeats: int = 2000, seed: int = SEED) -> Dict[str, float]:
+    """Returns microseconds per check_collisions call and per blocker collision test.
+
+    check_collisions is timed over the seeded action trace. The blocker tests
+    collide 12 bullets or 50 enemy sized rects placed around the blockers,
+    without killing, through sprite.groupcollide as reference and through
+    collide_sprites with the cached blocker rects.
+    """
+    game = SpaceInvaders(SCREEN, None, XRES_SCALED, YRES_SCALED, TICKS_REF, headless=True, seed=seed)
+    check_collisions, spent = game.check_collisions, []
+
+    def timed_check_collisions():
+        start = time.perf_counter()
+        reward = check_collisions()
+        spent.append(time.perf_counter() - start)
+        return reward
+
+    game.check_collisions = timed_check_collisions
+    play_trace(game, action_trace(steps, seed))
+    results = {"check_collisions": sum(spent) / len(spent)}
+
+    game = make_game(seed)
+    blockers, rects, bounds = game.blocker_rects()
+    rng = np.random.RandomState(seed)
+    for name, (count, width, height) in dict(bullets=(12, 5, 15), enemies=(50, 40, 35)).items():
+        group = pygame.sprite.Group()
+        for x, y in zip(rng.randint(0, XRES, count), rng.randint(BLOCKERS_POSITION - 50, BLOCKERS_POSITION + 50, count)):
+            rect_sprite = pygame.sprite.Sprite()
+            rect_sprite.rect = pygame.Rect(int(x), int(y), width, height)
+            group.add(rect_sprite)
+        sprites = group.sprites()
+        reference = pygame.sprite.groupcollide(group, game.allBlockers, False, False)
+        assert reference == collide_sprites(sprites, blockers, False, False, rects, bounds)
+        results[name + "_groupcollide"] = time_per_call(
+            lambda: pygame.sprite.groupcollide(group, game.allBlockers, False, False), repeats)
+        results[name + "_cached_rects"] = time_per_call(
+            lambda: collide_sprites(sprites, blockers, False, False, rects, bounds), repeats)
+    return {name: seconds * 1e6 for name, seconds in results.items()}
+
+
+def bench_replay(
+    capacities: Sequence[int] = (2 ** 10, 2 ** 12, 2 ** 14),
+    batch_size: int = 32,
+    repeats: int = 500,
+    seed: int = SEED,
+) -> Dict[str, Dict[str, float]]:
+    """Returns PrioritizedReplayBuffer operations per second for each capacity.
+
+    The buffer is filled to capacity with game sized frames, `store` is timed
+    over the fill, `sample_batch`, `sample_n_step` with horizons 1, 3 and 5
+    and `update_priorities` on the full buffer.
+    """
+    rs = np.random.RandomState(seed)
+    obs_dim = (3, YRES_SCALED, XRES_SCALED)
+    frames = list(rs.rand(64, *obs_dim).astype(np.float32))  # same objects, as next_obs becomes obs
+    results = {}
+    for capacity in capacities:
+        memory = PrioritizedReplayBuffer(obs_dim, capacity, batch_size, alpha=0.2)
+        actions = rs.randint(4, size=capacity)
+        rewards = rs.randint(2, size=capacity).astype(np.float32)
+        start = time.perf_counter()
+        for i in range(capacity):
+            memory.store(frames[i % 64], actions[i], rewards[i], frames[(i + 1) % 64], i % 500 == 499)
+        store = (time.perf_counter() - start) / capacity
+
+        sample = time_per_call(lambda: memory.sample_batch(0.6), repeats)
+        indices = memory.sample_batch(0.6)["indices"]
+        n_step = time_per_call(lambda: memory.sample_n_step(indices, (1, 3, 5)), repeats)
+        priorities = rs.rand(batch_size) + 1e-6
+        update = time_per_call(lambda: memory.update_priorities(indices, priorities), repeats)
+        results[str(capacity)] = dict(
+            store_per_sec=1 / store, sample_per_sec=1 / sample, n_step_per_sec=1 / n_step,
+            update_per_sec=1 / update,
+        )
+        del memory
+    return results
+
+
+def load_notebook(path: str, overrides: Dict) -> Dict:
+    """Returns the namespace of the notebook cells defining its model and agent.
+
+    Code cells run up to the one creating the agent, IPython magics and the
+    model summary are skipped and `overrides` are set again after every cell.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        cells = [cell for cell in json.load(f)["cells"] if cell["cell_type"] == "code"]
+    namespace = {"__name__": "__notebook__"}
+    for cell in cells:
+        source = "".join(cell["source"])
+        if "agent = Agent(" in source:
+            break
+        if "summary(model" in source:
+            continue
+        source = "\n".join(line for line in source.split("\n") if not line.lstrip().startswith("%"))
+        exec(compile(source, path, "exec"), namespace)
+        namespace.update(overrides)
+    return namespace
+
+
+def bench_train_model(
+    notebooks: Sequence[str] = NOTEBOOKS, fill: int = 64, repeats: int = 10, seed: int = SEED
+) -> Dict[str, float]:
+    """Returns milliseconds per Agent.train_model call for the agent of each notebook.
+
+    The agents play a seeded game with a fixed trace until `fill` transitions,
+    or sequences, are stored, their replay memory lives in a temporary directory.
+    """
+    import torch as t
+
+    results = {}
+    for path in notebooks:
+        with tempfile.TemporaryDirectory() as replay_dir:
+            namespace = load_notebook(path, dict(REPLAY_DIR=replay_dir, MEMORY_DEPTH=max(fill, 1024)))
+            random.seed(seed)
+            np.random.seed(seed)
+            t.manual_seed(seed)
+            agent = namespace["Agent"](namespace["STATE_SIZE"], namespace["ACTION_SIZE"])
+            game = SpaceInvaders(SCREEN, agent, XRES_SCALED, YRES_SCALED, TICKS_REF,
+                                 headless=True, seed=seed)
+            game.new_game()
+            episode = 1
+            while len(agent.memory) < fill:
+                if agent.play(game, episode):
+                    episode += 1
+                    game.new_game()
+            results[os.path.splitext(path)[0]] = time_per_call(agent.train_model, repeats) * 1e3
+            agent.sampler.close()
+    return results
+
+
+def bench_inference(
+    notebooks: Sequence[str] = NOTEBOOKS, actors: int = 16, steps: int = 10, seed: int = SEED
+) -> Dict[str, Dict[str, float]]:
+    """Returns greedy decisions per second of `actors` actors for the model of each notebook.
+
+    "single" runs one forward per decision like Agent.act used to, "server"
+    has one thread per actor asking an InferenceServer.
+    """
+    import torch as t
+
+    results = {}
+    for path in notebooks:
+        with tempfile.TemporaryDirectory() as replay_dir:
+            namespace = load_notebook(path, dict(REPLAY_DIR=replay_dir))
+        t.manual_seed(seed)
+        model = namespace["SpaceModel"](namespace["STATE_SIZE"], namespace["ACTION_SIZE"], 256)
+        model = model.to(namespace["DEVICE"]).eval()
+        states = np.random.RandomState(seed).rand(actors, *namespace["STATE_SIZE"]).astype(np.float32)
+
+        def single():
+            hidden = [None] * actors
+            with t.no_grad():
+                for _ in range(steps):
+                    for i in range(actors):
+                        state = t.from_numpy(states[i][np.newaxis]).to(namespace["DEVICE"])
+                        q_values, hidden[i] = model(state, hidden[i])
+                        q_values.argmax(dim=1).cpu()
+
+        server = InferenceServer(model, namespace["DEVICE"], forward=getattr(model, "forward_actors", None))
+
+        def served():
+            threads = [
+                threading.Thread(target=lambda i=i: [server.act(i, states[i]) for _ in range(steps)])
+                for i in range(actors)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        decisions = actors * steps
+        results[os.path.splitext(path)[0]] = dict(
+            single_per_sec=decisions / time_per_call(single, 1),
+            server_per_sec=decisions / time_per_call(served, 1),
+        )
+        server.close()
+    return results
+
+
+def metadata() -> Dict[str, str]:
+    """Returns versions and machine the results were measured with."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return dict(
+        time=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        commit=commit,
+        python=platform.python_version(),
+        numpy=np.__version__,
+        pygame=pygame.version.ver,
+        machine=platform.machine(),
+        processor=platform.processor(),
+    )
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    """Returns the numeric leaves of nested results keyed by their dotted path."""
+    flat = {}
+    for name, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, prefix + name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + name] = value
+    return flat
+
+
+def compare(results: Dict, baseline: Dict):
+    """Print every metric next to its baseline value."""
+    new, old = flatten(results), flatten(baseline)
+    for name in sorted(new):
+        if name in old and old[name]:
+            print("{:<44} {:14.2f} {:14.2f} {:+8.1%}".format(
+                name, old[name], new[name], new[name] / old[name] - 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output", default=RESULTS_FILE, help="json file the results are written to")
+    parser.add_argument("--baseline", help="json results of a previous run to compare with")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--steps", type=int, default=3000, help="env steps per stepping mode")
+    parser.add_argument("--capacities", type=int, nargs="+", default=[2 ** 10, 2 ** 12, 2 ** 14])
+    parser.add_argument("--no-train", action="store_true", help="skip the agent benchmarks")
+    args = parser.parse_args()
+
+    results = dict(meta=metadata(), peak_rss_mb={})
+    results["env"] = bench_env(args.steps, args.seed)
+    results["peak_rss_mb"]["env"] = peak_rss_mb()
+    results["get_state_us"] = bench_get_state()
+    results["peak_rss_mb"]["get_state"] = peak_rss_mb()
+    results["collisions_us"] = bench_collisions(args.steps, seed=args.seed)
+    results["replay"] = bench_replay(args.capacities, seed=args.seed)
+    results["peak_rss_mb"]["replay"] = peak_rss_mb()
+    if not args.no_train:
+        results["train_model_ms"] = bench_train_model(seed=args.seed)
+        results["peak_rss_mb"]["train_model"] = peak_rss_mb()
+        results["inference"] = bench_inference(seed=args.seed)
+        results["peak_rss_mb"]["inference"] = peak_rss_mb()
+
+    for name, value in flatten(results).items():
+        print("{:<44} {:14.2f}".format(name, value))
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        print("\n{:<44} {:>14} {:>14} {:>8}".format("metric", "baseline", "new", "change"))
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""Checkpoints of the training state written in the background."""
+
+import glob
+import os
+import queue
+import threading
+from typing import Any, Dict, Optional
+
+import torch as t
+
+
+def detached_copy(obj: Any) -> Any:
+    """Returns obj with every tensor copied to the cpu, containers are copied too."""
+    if isinstance(obj, t.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, detached_copy(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(detached_copy(v) for v in obj)
+    return obj
+
+
+class CheckpointManager:
+    """ Write checkpoints on a background thread and keep the latest ones.
+
+    `save` copies the tensors of the state on the calling thread and returns,
+    a writer thread serializes the copy to a temporary file that is renamed
+    to `checkpoint-<step>.pt` once complete, so a crash never leaves a
+    partial checkpoint behind. Only the last `keep` checkpoints are kept.
+    At most one checkpoint waits for the writer, `save` blocks while another
+    is queued.
+
+    Attributes:
+        path (str): directory of the checkpoints
+        keep (int): number of checkpoints kept
+        interval (int): steps between checkpoints, see `due`
+
+    """
+
+    def __init__(self, path: str, keep: int = 3, interval: int = 1):
+        """Initialization.
+
+        Args:
+            path (str): directory of the checkpoints
+            keep (int): number of checkpoints kept
+            interval (int): steps between checkpoints
+
+        """
+        assert keep >= 1 and interval >= 1
+        self.path = path
+        self.keep = keep
+        self.interval = interval
+        self.error: Optional[BaseException] = None
+        self.requests = queue.Queue(maxsize=1)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def due(self, step: int) -> bool:
+        """Returns True if a checkpoint should be saved at `step`."""
+        return step % self.interval == 0
+
+    def save(self, step: int, state: Dict):
+        """Queue a copy of `state` to be written as the checkpoint of `step`."""
+        self._raise()
+        self.requests.put((step, detached_copy(state)))
+
+    def wait(self):
+        """Block until the queued checkpoints are written."""
+        self.requests.join()
+        self._raise()
+
+    def checkpoints(self):
+        """Returns the complete checkpoint files, oldest first."""
+        return sorted(glob.glob(os.path.join(self.path, "checkpoint-*.pt")))
+
+    def load(self, map_location: Any = "cpu") -> Optional[Dict]:
+        """Returns the state of the latest checkpoint, None if there is none."""
+        files = self.checkpoints()
+        if not files:
+            return None
+        return t.load(files[-1], map_location=map_location, weights_only=False)
+
+    def close(self):
+        """Write the queued checkpoints and stop the writer thread."""
+        self.requests.put(None)
+        self.thread.join()
+        self._raise()
+
+    def _raise(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            request = self.requests.get()
+            try:
+                if request is None:
+                    return
+                self._write(*request)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.requests.task_done()
+
+    def _write(self, step: int, state: Dict):
+        os.makedirs(self.path, exist_ok=True)
+        file = os.path.join(self.path, "checkpoint-{:08d}.pt".format(step))
+        with open(file + ".tmp", "wb") as f:
+            t.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file + ".tmp", file)
+        for old in self.checkpoints()[:-self.keep]:
+            os.remove(old)
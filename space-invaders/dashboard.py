@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Live view of training rendered in a separate process."""
+
+import math
+import multiprocessing as mp
+import threading
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from metrics import FieldSummary, MetricsReader
+
+
+class FrameRing:
+    """ Shared memory ring of the latest frames, written by a single process.
+
+    Every slot holds a uint8 frame and the float values published with it.
+    The writer marks a slot as busy, copies into it and stores its sequence
+    number; readers copy the newest slot and drop the copy if the sequence
+    number changed meanwhile, so neither side ever waits for the other.
+
+    Attributes:
+        shape (tuple): shape of the frames
+        fields (tuple): names of the values published with every frame
+        slots (int): number of frames in the ring
+        name (str): name of the shared memory block
+        seq (int): sequence number of the last frame written or read
+
+    """
+
+    def __init__(self, shape: Tuple[int, ...], fields: Sequence[str] = (), slots: int = 3, name: str = None):
+        """Initialization.
+
+        Args:
+            shape (tuple): shape of the frames
+            fields (list): names of the values published with every frame
+            slots (int): number of frames in the ring
+            name (str): shared memory block to attach to, None creates one
+
+        """
+        self.shape = tuple(shape)
+        self.fields = tuple(fields)
+        self.slots = slots
+        # latest sequence number and the one of every slot, values, frames
+        sizes = [8 * (1 + slots), 8 * slots * max(len(self.fields), 1), slots * int(np.prod(shape))]
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=sum(sizes))
+        self.name = self.shm.name
+        self.header = np.ndarray((1 + slots,), np.int64, self.shm.buf, 0)
+        self.values = np.ndarray((slots, max(len(self.fields), 1)), np.float64, self.shm.buf, sizes[0])
+        self.frames = np.ndarray((slots, *self.shape), np.uint8, self.shm.buf, sizes[0] + sizes[1])
+        if self.owner:
+            self.header[:] = 0
+        self.seq = 0
+
+    def publish(self, frame: np.ndarray, **values: float):
+        """Copy a frame and its values into the next slot."""
+        seq = self.seq + 1
+        slot = seq % self.slots
+        self.header[1 + slot] = -1
+        self.frames[slot] = frame
+        self.values[slot, :len(self.fields)] = [values.get(field, math.nan) for field in self.fields]
+        self.header[1 + slot] = seq
+        self.header[0] = seq
+        self.seq = seq
+
+    def read(self) -> Optional[Tuple[np.ndarray, Dict[str, float]]]:
+        """Returns a copy of the newest frame and its values, None if there is no new one."""
+        seq = int(self.header[0])
+        slot = seq % self.slots
+        if seq == self.seq or self.header[1 + slot] != seq:
+            return None
+        frame, values = self.frames[slot].copy(), self.values[slot].tolist()
+        if self.header[1 + slot] != seq:
+            return None
+        self.seq = seq
+        return frame, dict(zip(self.fields, values))
+
+    def close(self):
+        """Detach from the shared memory, the process that created it also frees it."""
+        self.header = self.values = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class Dashboard:
+    """ Live view of the game screen and the episode scores.
+
+    The training loop only copies frames into a `FrameRing`. A separate
+    process reads the newest frame and the records appended to the metrics
+    log, redraws the score plot when new episodes were logged and encodes the
+    view as jpeg; a thread passes every view to `show`. How often frames are
+    published no longer costs training more than a copy.
+
+    Attributes:
+        ring (FrameRing): frames read by the render process
+        process (Process): render process
+
+    """
+
+    def __init__(
+        self,
+        shape: Tuple[int, int, int],
+        show: Callable[[bytes], None],
+        metrics_path: str = None,
+        fields: Sequence[str] = ("epsilon",),
+        fps: float = 5.0,
+        size: Tuple[int, int] = (500, 400),
+    ):
+        """Initialization.
+
+        Args:
+            shape (tuple): (height, width, 3) for rgb frames, (height, width, 4) for
+                bgrx ones like the bytes of a 32 bit pygame surface
+            show (callable): called with every jpeg encoded view
+            metrics_path (str): directory of the metrics log, None plots no scores
+            fields (list): values published with the frames, shown after the scores
+            fps (float): highest rate of the views
+            size (tuple): width and height of the screen and of the plot in the view
+
+        """
+        ctx = mp.get_context("spawn")
+        self.ring = FrameRing(shape, fields)
+        receive, send = ctx.Pipe(duplex=False)
+        self.stop = ctx.Event()
+        self.process = ctx.Process(
+            target=render,
+            args=(self.ring.name, shape, self.ring.fields, metrics_path, send, self.stop, 1.0 / fps, size),
+            daemon=True,
+        )
+        self.process.start()
+        send.close()
+        self.thread = threading.Thread(target=self._receive, args=(receive, show), daemon=True)
+        self.thread.start()
+
+    def publish(self, frame: np.ndarray, **values: float):
+        """Publish a frame and the values shown with it."""
+        self.ring.publish(frame, **values)
+
+    def close(self):
+        """Stop the render process and free the ring."""
+        self.stop.set()
+        self.process.join()
+        self.thread.join()
+        self.ring.close()
+
+    def _receive(self, conn, show: Callable[[bytes], None]):
+        while True:
+            try:
+                data = conn.recv_bytes()
+            except EOFError:
+                return
+            show(data)
+
+
+def render(ring_name, shape, fields, metrics_path, conn, stop, interval, size):
+    """Render process of a `Dashboard`, sends views until `stop` is set."""
+    ring = FrameRing(shape, fields, name=ring_name)
+    reader = MetricsReader(metrics_path) if metrics_path is not None else None
+    fig = Figure(figsize=(size[0] / 50, size[1] / 50), dpi=50)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    frame = plot = None
+    plotted = -1
+    try:
+        while not stop.wait(interval):
+            latest = ring.read()
+            records = reader.poll() if reader is not None else 0
+            if latest is not None:
+                frame, values = latest
+            if frame is None or (latest is None and not records):
+                continue
+
+            scores = reader.summary("episode", "score") if reader is not None else FieldSummary()
+            if scores.count != plotted:
+                plot = plot_scores(scores, canvas, ax, size)
+                plotted = scores.count
+
+            text = [str(np.round(scores.mean(), decimals=2)), str(scores.max if scores.count else 0), str(scores.count)]
+            text += [str(values[field]) for field in fields]
+            img_bgr = cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR if shape[2] == 4 else cv2.COLOR_RGB2BGR)
+            img_bgr = cv2.putText(img_bgr, "/".join(text), (0, shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 0, 255), 2)
+            img_bgr = cv2.resize(img_bgr, size, None)
+            ret, img_data = cv2.imencode(".jpg", np.hstack((img_bgr, plot)))
+            assert ret
+            conn.send_bytes(img_data.tobytes())
+    finally:
+        conn.close()
+        ring.close()
+
+
+def plot_scores(scores: FieldSummary, canvas: FigureCanvasAgg, ax, size: Tuple[int, int]) -> np.ndarray:
+    """Returns the bgr image of the average scores and their trend."""
+    if scores.count > 100 * 2:
+        # means of blocks of 100 or more episodes, kept by the metrics log
+        avg = np.array(scores.blocks)
+        x_ticks = range(scores.block, (len(avg) + 1) * scores.block, scores.block)
+    else:
+        window = np.array(scores.window)
+        w = min(10, len(window))
+        avg = np.convolve(window, np.ones(w), "valid") / w if w else window
+        x_ticks = range(len(avg))
+
+    ax.cla()
+    if len(avg):
+        z = np.polyfit(range(len(avg)), avg, 1) if len(avg) > 1 else np.zeros_like(avg)
+        ax.plot(x_ticks, avg)
+        ax.plot(x_ticks, np.poly1d(z)(range(len(avg))))
+    canvas.figure.suptitle("Average Score")
+
+    # convert canvas to image
+    canvas.draw()
+    img_sts = np.asarray(canvas.buffer_rgba())
+    img_sts = cv2.cvtColor(img_sts, cv2.COLOR_RGBA2BGR)
+    return cv2.resize(img_sts, size, None)
@@ -5,8 +5,9 @@
 # Altered by Cátia Teixeira (November 2023)
 
 
+from collections import OrderedDict
 from os.path import abspath, dirname
-from random import choice
+import random
 from pygame import *
 import numpy as np
 import cv2
@@ -34,17 +35,50 @@ IMG_NAMES = [
   'explosionblue', 'explosiongreen', 'explosionpurple',
   'laser', 'enemylaser'
 ]
-IMAGES = {name: image.load(IMAGE_PATH + '{}.png'.format(name)).convert_alpha() for name in IMG_NAMES}
+IMG_FILES = dict({name: name + '.png' for name in IMG_NAMES}, background='background.jpg')
+IMAGES = {} # (image, converted) by (name, size), loaded and scaled once on first use
 
 BLOCKERS_POSITION = 450
 ENEMY_DEFAULT_POSITION = 65  # Initial value for a new game
+ENEMY_X_POSITION = 157 # x of the first column
+ENEMY_X_SPACING = 50
+ENEMY_Y_SPACING = 45
+ENEMY_WIDTH = 40
+ENEMY_HEIGHT = 35
 ENEMY_MOVE_DOWN = 35
 
 BULLET_SPEED = 20
 MOVE_SPEED = 20
-TICKS = 0
 
 BASE_SCORE_REWARD = 1.0
+
+# Symbolic state, positions scaled by the screen size
+MAX_BULLETS = 2
+MAX_ENEMY_BULLETS = 16 # closest to the bottom are kept
+SYMBOLIC_FIELDS = [
+  ('ship', 2), # x, alive
+  ('lives', 1), # spare lives / 3
+  ('enemies', 5 * 10), # alive mask of the enemy grid, row major
+  ('enemies_offset', 2), # x, y of the grid top left
+  ('bullets', MAX_BULLETS * 3), # x, y, present
+  ('enemy_bullets', MAX_ENEMY_BULLETS * 3), # x, y, present
+  ('mystery', 3), # x, y, on screen
+  ('blockers', 4 * 4 * 9), # occupancy mask per blocker, row major
+]
+SYMBOLIC_SLICES = {}
+SYMBOLIC_STATE_SIZE = 0
+for name, size in SYMBOLIC_FIELDS:
+    SYMBOLIC_SLICES[name] = slice(SYMBOLIC_STATE_SIZE, SYMBOLIC_STATE_SIZE + size)
+    SYMBOLIC_STATE_SIZE += size
+
+# Game state kept by snapshot, besides the sprites
+SNAPSHOT_FIELDS = ['ticks', 'currentTime', 'startGame', 'mainScreen', 'gameOver', 'enemyPosition',
+                   'score', 'prev_score', 'reward', 'last_score', 'timer', 'noteTimer', 'shipTimer',
+                   'gameTimer', 'makeNewShip', 'shipAlive', 'self_injury', 'bulletDodged']
+SNAPSHOT_ENEMIES_FIELDS = ['x', 'y', 'imageIndex', 'leftAddMove', 'rightAddMove', 'moveTime',
+                           'direction', 'rightMoves', 'leftMoves', 'moveNumber', 'moveDownCount',
+                           'moveCount', 'timer', 'bottom', '_leftAliveColumn', '_rightAliveColumn',
+                           'alive_enemies']
 #BASE_REWARD       = 0.0001
 #BASE_DOWN_PENALTY = -0.1
 #BASE_DODGED_REWARD = 0.0001
@@ -54,14 +88,85 @@ BASE_SCORE_REWARD = 1.0
 #BASE_PENALTY_LOSE_LIFE =  -0.5
 #BASE_WIN_REWARD = 1
 
-def get_time_ticks(): # added ticks to forward the game
-    global TICKS
-    return TICKS
+def get_image(name, size=None):
+    # no display needed at import, images are converted once one exists
+    img, converted = IMAGES.get((name, size), (None, False))
+    if converted:
+        return img
+    if img is None and size is not None:
+        img = transform.scale(get_image(name), size)
+    elif img is None:
+        img = image.load(IMAGE_PATH + IMG_FILES[name])
+    if display.get_surface() is not None:
+        img = img.convert_alpha()
+        converted = True
+    IMAGES[(name, size)] = (img, converted)
+    return img
+
+FONTS = {} # loaded fonts by (file, size), parsing the ttf is slow
+TEXTS = OrderedDict() # rendered text surfaces, least recently used first
+TEXTS_SIZE = 256
+
+def load_font(textFont, size):
+    if (textFont, size) not in FONTS:
+        FONTS[(textFont, size)] = font.Font(textFont, size)
+    return FONTS[(textFont, size)]
+
+def render_text(textFont, size, message, color):
+    key = (textFont, size, message, color)
+    if key in TEXTS:
+        TEXTS.move_to_end(key)
+        return TEXTS[key]
+    surface = load_font(textFont, size).render(message, True, color)
+    TEXTS[key] = surface
+    if len(TEXTS) > TEXTS_SIZE:
+        TEXTS.popitem(last=False)
+    return surface
+
+def collide_sprites(spritesa, spritesb, dokilla, dokillb, rectsb=None, boundsb=None):
+    # sprite.groupcollide for sprite lists with the same results and kill order,
+    # rect tests run in C through Rect.collidelistall from the smaller side and
+    # sprites of a outside boundsb (bounding rect of b) are skipped
+    crashed = {}
+    if not spritesa or not spritesb:
+        return crashed
+    rectsa = [s.rect for s in spritesa]
+    if rectsb is None:
+        rectsb = [s.rect for s in spritesb]
+    if boundsb is not None:
+        candidates = [i for i, rect in enumerate(rectsa) if rect.colliderect(boundsb)]
+    else:
+        candidates = range(len(rectsa))
+    if len(candidates) <= len(rectsb):
+        hits = {i: rectsa[i].collidelistall(rectsb) for i in candidates}
+    else:
+        hits = {}
+        for j, rect in enumerate(rectsb):
+            for i in rect.collidelistall(rectsa):
+                hits.setdefault(i, []).append(j)
+    return resolve_collisions(spritesa, spritesb, hits, dokilla, dokillb)
+
+def resolve_collisions(spritesa, spritesb, hits, dokilla, dokillb):
+    # hits maps indices of a to the indices of b they overlap, in order of b
+    crashed = {}
+    killed = set()
+    for i in sorted(hits):
+        collision = [j for j in hits[i] if j not in killed]
+        if not collision:
+            continue
+        crashed[spritesa[i]] = [spritesb[j] for j in collision]
+        if dokillb:
+            killed.update(collision)
+            for j in collision:
+                spritesb[j].kill()
+        if dokilla:
+            spritesa[i].kill()
+    return crashed
 
 class Text(object):
     def __init__(self, textFont, size, message, color, xpos, ypos):
-        self.font = font.Font(textFont, size)
-        self.surface = self.font.render(message, True, color)
+        self.font = load_font(textFont, size)
+        self.surface = render_text(textFont, size, message, color)
         self.rect = self.surface.get_rect(topleft=(xpos, ypos))
 
     def draw(self, surface):
@@ -70,18 +175,14 @@ class Text(object):
 class Life(sprite.Sprite):
     def __init__(self, xpos, ypos, game):
         sprite.Sprite.__init__(self)
-        self.image = IMAGES['ship']
-        self.image = transform.scale(self.image, (23, 23))
+        self.image = get_image('ship', (23, 23))
         self.rect = self.image.get_rect(topleft=(xpos, ypos))
         self.game = game
 
-    def update(self, *args):
-        self.game.screen.blit(self.image, self.rect)
-
 class Ship(sprite.Sprite):
     def __init__(self, game):
         sprite.Sprite.__init__(self)
-        self.image = IMAGES['ship']
+        self.image = get_image('ship')
         self.rect = self.image.get_rect(topleft=(375, 540))
         self.speed = 5
         self.fired = False # adapted for AISHIP
@@ -101,9 +202,6 @@ class AIShip(Ship): # created so that ship is controled by AI agent
         Ship.__init__(self, game)
         self.speed = MOVE_SPEED
 
-    def update(self, keys, *args): # displays AI ship in screen
-        self.game.screen.blit(self.image, self.rect)
-
     def action_update(self, action): # adapted from Ship
         if action == 1:
             self.fired = True
@@ -115,7 +213,7 @@ class AIShip(Ship): # created so that ship is controled by AI agent
 class Bullet(sprite.Sprite):
     def __init__(self, xpos, ypos, direction, speed, filename, side, game, bullet_id=-1):
         sprite.Sprite.__init__(self)
-        self.image = IMAGES[filename]
+        self.image = get_image(filename)
         self.rect = self.image.get_rect(topleft=(xpos, ypos))
         self.speed = speed
         self.direction = direction
@@ -125,14 +223,13 @@ class Bullet(sprite.Sprite):
         self.game = game
 
     def update(self, keys, *args):
-        self.game.screen.blit(self.image, self.rect)
         self.rect.y += self.speed * self.direction
         if self.rect.y < 15 or self.rect.y > 600:
             self.kill()
             if self.direction > 0:
                 self.game.bulletDodged += 1
 
-class Enemy(sprite.Sprite):
+class Enemy(sprite.Sprite): # drawn only, the formation lives in EnemiesGroup
     def __init__(self, row, column, game):
         sprite.Sprite.__init__(self)
         self.row = row
@@ -144,15 +241,6 @@ class Enemy(sprite.Sprite):
         self.rect = self.image.get_rect()
         self.game = game
 
-    def toggle_image(self):
-        self.index += 1
-        if self.index >= len(self.images):
-            self.index = 0
-        self.image = self.images[self.index]
-
-    def update(self, *args):
-        self.game.screen.blit(self.image, self.rect)
-
     def load_images(self):
         images = {0: ['1_2', '1_1'],
                   1: ['2_2', '2_1'],
@@ -160,17 +248,24 @@ class Enemy(sprite.Sprite):
                   3: ['3_1', '3_2'],
                   4: ['3_1', '3_2'],
                   }
-        img1, img2 = (IMAGES['enemy{}'.format(img_num)] for img_num in
-                      images[self.row])
-        self.images.append(transform.scale(img1, (40, 35)))
-        self.images.append(transform.scale(img2, (40, 35)))
+        for img_num in images[self.row]:
+            self.images.append(get_image('enemy{}'.format(img_num), (ENEMY_WIDTH, ENEMY_HEIGHT)))
 
 class EnemiesGroup(sprite.Group):
+    # The formation is its top left corner (x, y), an alive grid and alive counts
+    # per column, all enemies move together. Sprites are only moved to the
+    # formation when they are drawn or handed out (sync_sprites, place).
     def __init__(self, columns, rows, game):
         sprite.Group.__init__(self)
         self.enemies = [[None] * columns for _ in range(rows)]
+        self.alive = np.zeros((rows, columns), dtype=bool)
+        self.columnCounts = [0] * columns
         self.columns = columns
         self.rows = rows
+        self.x = ENEMY_X_POSITION
+        self.y = game.enemyPosition
+        self.imageIndex = 0
+        self.synced = True
         self.leftAddMove = 0
         self.rightAddMove = 0
         self.moveTime = 600
@@ -180,9 +275,9 @@ class EnemiesGroup(sprite.Group):
         self.moveNumber = 15
         self.moveDownCount = 0
         self.moveCount = 0
-        self.timer = get_time_ticks() # changed 
         self.game = game
-        self.bottom = self.game.enemyPosition + ((rows - 1) * 45) + 35
+        self.timer = game.get_time_ticks() # changed 
+        self.bottom = self.game.enemyPosition + ((rows - 1) * ENEMY_Y_SPACING) + ENEMY_HEIGHT
         self._aliveColumns = list(range(columns))
         self._leftAliveColumn = 0
         self._rightAliveColumn = columns - 1
@@ -202,24 +297,58 @@ class EnemiesGroup(sprite.Group):
                 self.rightMoves = 30 + self.leftAddMove
                 self.direction *= -1
                 self.moveNumber = 0
-                self.bottom = 0
-                for enemy in self:
-                    enemy.rect.y += ENEMY_MOVE_DOWN
-                    enemy.toggle_image()
-                    if self.bottom < enemy.rect.y + 35:
-                        self.bottom = enemy.rect.y + 35
+                self.y += ENEMY_MOVE_DOWN
+                rows = np.flatnonzero(self.alive.any(axis=1))
+                self.bottom = self.y + int(rows[-1]) * ENEMY_Y_SPACING + ENEMY_HEIGHT if len(rows) else 0
             else:
-                velocity = 10 if self.direction == 1 else -10
-                for enemy in self:
-                    enemy.rect.x += velocity
-                    enemy.toggle_image()
+                self.x += 10 if self.direction == 1 else -10
                 self.moveNumber += 1
+            self.imageIndex = 1 - self.imageIndex
+            self.synced = False
             self.timer += self.moveTime
 
+    def place(self, enemy): # move one sprite to its place in the formation
+        enemy.rect.topleft = (self.x + enemy.column * ENEMY_X_SPACING, self.y + enemy.row * ENEMY_Y_SPACING)
+        enemy.index = self.imageIndex
+        enemy.image = enemy.images[enemy.index]
+        return enemy
+
+    def sync_sprites(self): # before drawing
+        if not self.synced:
+            for enemy in self:
+                self.place(enemy)
+            self.synced = True
+
+    def cells_hit(self, rect): # grid indices of alive enemies overlapping rect, row major
+        if rect.width <= 0 or rect.height <= 0:
+            return []
+        c0 = max((rect.x - ENEMY_WIDTH - self.x) // ENEMY_X_SPACING + 1, 0)
+        c1 = min((rect.right - 1 - self.x) // ENEMY_X_SPACING, self.columns - 1)
+        r0 = max((rect.y - ENEMY_HEIGHT - self.y) // ENEMY_Y_SPACING + 1, 0)
+        r1 = min((rect.bottom - 1 - self.y) // ENEMY_Y_SPACING, self.rows - 1)
+        return [row * self.columns + column
+                for row in range(r0, r1 + 1) for column in range(c0, c1 + 1) if self.alive[row, column]]
+
+    def collide(self, spritesb, dokilla, dokillb): # collide_sprites with the enemies as group a
+        hits = {}
+        for j, spriteb in enumerate(spritesb):
+            for i in self.cells_hit(spriteb.rect):
+                hits.setdefault(i, []).append(j)
+        if not hits:
+            return {}
+        spritesa = [enemy for enemyRow in self.enemies for enemy in enemyRow]
+        crashed = resolve_collisions(spritesa, spritesb, hits, dokilla, dokillb)
+        for enemy in crashed:
+            self.place(enemy)
+        return crashed
+
     def add_internal(self, *sprites):
         super(EnemiesGroup, self).add_internal(*sprites)
         for s in sprites:
             self.enemies[s.row][s.column] = s
+            if not self.alive[s.row, s.column]:
+                self.alive[s.row, s.column] = True
+                self.columnCounts[s.column] += 1
 
     def remove_internal(self, *sprites):
         super(EnemiesGroup, self).remove_internal(*sprites)
@@ -228,12 +357,12 @@ class EnemiesGroup(sprite.Group):
         self.update_speed()
 
     def is_column_dead(self, column):
-        return not any(self.enemies[row][column] for row in range(self.rows))
+        return self.columnCounts[column] == 0
 
     def random_bottom(self):
-        col = choice(self._aliveColumns)
-        col_enemies = (self.enemies[row - 1][col] for row in range(self.rows, 0, -1))
-        return next((en for en in col_enemies if en is not None), None)
+        col = self.game.random.choice(self._aliveColumns)
+        row = np.flatnonzero(self.alive[:, col])[-1]
+        return self.place(self.enemies[row][col])
 
     def update_speed(self):
         if len(self) == 1:
@@ -243,6 +372,8 @@ class EnemiesGroup(sprite.Group):
 
     def kill(self, enemy):
         self.enemies[enemy.row][enemy.column] = None
+        self.alive[enemy.row, enemy.column] = False
+        self.columnCounts[enemy.column] -= 1
         is_column_dead = self.is_column_dead(enemy.column)
         if is_column_dead:
             self._aliveColumns.remove(enemy.column)
@@ -259,7 +390,7 @@ class EnemiesGroup(sprite.Group):
                 is_column_dead = self.is_column_dead(self._leftAliveColumn)
         
     def count_alive_enemies(self): #aid to give penalty
-        return sum(sublist.count(elem) for sublist in self.enemies for elem in sublist if elem is not None)
+        return len(self)
 
 class Blocker(sprite.Sprite):
     def __init__(self, size, color, row, column, game):
@@ -274,19 +405,15 @@ class Blocker(sprite.Sprite):
         self.column = column
         self.game = game
 
-    def update(self, keys, *args):
-        self.game.screen.blit(self.image, self.rect)
-
 class Mystery(sprite.Sprite):
     def __init__(self, game):
         sprite.Sprite.__init__(self)
-        self.image = IMAGES['mystery']
-        self.image = transform.scale(self.image, (75, 35))
+        self.image = get_image('mystery', (75, 35))
         self.rect = self.image.get_rect(topleft=(-80, 45))
         self.row = 5
         self.moveTime = 25000
         self.direction = 1
-        self.timer = get_time_ticks()
+        self.timer = game.get_time_ticks()
         self.mysteryEntered = None # removed sound
         self.playSound = False # removed sound
         self.missed = 0  # chose anothe approach
@@ -302,11 +429,9 @@ class Mystery(sprite.Sprite):
             if self.rect.x < 840 and self.direction == 1:
                 #self.mysteryEntered.fadeout(4000) # removed sound
                 self.rect.x += 2
-                self.game.screen.blit(self.image, self.rect)
             if self.rect.x > -100 and self.direction == -1:
                 #self.mysteryEntered.fadeout(4000) # removed sound
                 self.rect.x -= 2
-                self.game.screen.blit(self.image, self.rect)
         if self.rect.x > 830:
             self.playSound = True
             self.direction = -1
@@ -322,65 +447,72 @@ class Mystery(sprite.Sprite):
 class EnemyExplosion(sprite.Sprite):
     def __init__(self, enemy, game, *groups):
         super(EnemyExplosion, self).__init__(*groups)
-        self.image = transform.scale(self.get_image(enemy.row), (40, 35))
-        self.image2 = transform.scale(self.get_image(enemy.row), (50, 45))
+        self.image = self.get_image(enemy.row, (40, 35))
+        self.image2 = self.get_image(enemy.row, (50, 45))
         self.rect = self.image.get_rect(topleft=(enemy.rect.x, enemy.rect.y))
-        self.timer = get_time_ticks()
+        self.row = enemy.row
+        self.timer = game.get_time_ticks()
         self.game = game
 
     @staticmethod
-    def get_image(row):
+    def get_image(row, size):
         img_colors = ['purple', 'blue', 'blue', 'green', 'green']
-        return IMAGES['explosion{}'.format(img_colors[row])]
+        return get_image('explosion{}'.format(img_colors[row]), size)
 
     def update(self, current_time, *args):
+        if 400 < current_time - self.timer:
+            self.kill()
+
+    def draw(self, surface, current_time):
         passed = current_time - self.timer
         if passed <= 100:
-            self.game.screen.blit(self.image, self.rect)
+            surface.blit(self.image, self.rect)
         elif passed <= 200:
-            self.game.screen.blit(self.image2, (self.rect.x - 6, self.rect.y - 6))
-        elif 400 < passed:
-            self.kill()
+            surface.blit(self.image2, (self.rect.x - 6, self.rect.y - 6))
 
 class MysteryExplosion(sprite.Sprite):
     def __init__(self, mystery, score, game, *groups):
         super(MysteryExplosion, self).__init__(*groups)
+        self.score = score
         self.text = Text(FONT, 20, str(score), WHITE,
                          mystery.rect.x + 20, mystery.rect.y + 6)
-        self.timer = get_time_ticks()
+        self.timer = game.get_time_ticks()
         self.game = game
 
     def update(self, current_time, *args):
+        if 600 < current_time - self.timer:
+            self.kill()
+
+    def draw(self, surface, current_time):
         passed = current_time - self.timer
         if passed <= 200 or 400 < passed <= 600:
-            self.text.draw(self.game.screen)
-        elif 600 < passed:
-            self.kill()
+            self.text.draw(surface)
 
 class ShipExplosion(sprite.Sprite):
     def __init__(self, ship, game, *groups):
         super(ShipExplosion, self).__init__(*groups)
-        self.image = IMAGES['ship']
+        self.image = get_image('ship')
         self.rect = self.image.get_rect(topleft=(ship.rect.x, ship.rect.y))
-        self.timer = get_time_ticks()
+        self.timer = game.get_time_ticks()
         self.game = game
 
     def update(self, current_time, *args):
-        passed = current_time - self.timer
-        if 300 < passed <= 600:
-            self.game.screen.blit(self.image, self.rect)
-        elif 900 < passed:
+        if 900 < current_time - self.timer:
             self.kill()
 
+    def draw(self, surface, current_time):
+        if 300 < current_time - self.timer <= 600:
+            surface.blit(self.image, self.rect)
+
 class SpaceInvaders(object):
-    global TICKS
 
-    def __init__(self, screen, agent, state_xres, state_yres, ticks_ref):
+    def __init__(self, screen, agent, state_xres, state_yres, ticks_ref, headless=False,
+                 state_dtype=np.float32, state_grayscale=False, state_crop=None, state_hud=True,
+                 seed=None):
         init()
         self.clock = time.Clock()
         self.caption = display.set_caption('Space Invaders')
         self.screen = screen
-        self.background = image.load(IMAGE_PATH + 'background.jpg').convert()
         self.startGame = False
         self.mainScreen = True
         self.gameOver = False
@@ -396,6 +528,8 @@ class SpaceInvaders(object):
         self.enemy4Text = Text(FONT, 25, '   =  ?????', RED, 368, 420)
         self.scoreText = Text(FONT, 20, 'Score', WHITE, 5, 5)
         self.livesText = Text(FONT, 20, 'Lives ', WHITE, 640, 5)
+        self.scoreText2 = None # re-rendered only when the score string changes
+        self.scoreString = None
         self.life1 = Life(715, 3, self)
         self.life2 = Life(742, 3, self)
         self.life3 = Life(769, 3, self)
@@ -406,12 +540,32 @@ class SpaceInvaders(object):
         self.bulletDodged = 0 # experiment
         self.state_xres = state_xres # rescaling image for train
         self.state_yres = state_yres # rescaling image for train
+        self.state_dtype = np.dtype(state_dtype) # uint8 leaves normalizing to the model
+        self.state_grayscale = state_grayscale # single channel state
+        self.state_crop = state_crop # (top, bottom, left, right) of screen kept in state
+        self.state_hud = state_hud # False leaves score and lives off the screen and state
+        self.state_channels = 1 if state_grayscale else 3
+        self.resized = None # preallocated resize output
         self.TICKS_REF = ticks_ref # base time resolution for game
+        self.ticks = 0 # game clock, owned by each instance
         self.score = 0
         self.prev_score = 0
+        self.headless = headless # skip drawing in step, render only on get_state
+        self.frameDirty = True
+        self.currentTime = self.get_time_ticks()
+        self.enemyPool = None # sprites reused by restore, see sprite_pools
+        self.blockerPool = None
+        self.newGameSnapshot = None # see new_game
+        self.seed(seed)
+
+    def seed(self, seed=None): # own random generator, None shares the module random with other games
+        self.random = random if seed is None else random.Random(seed)
+
+    @property
+    def background(self): # loaded on first use, not drawn at the moment
+        return get_image('background')
 
     def reset(self, score):
-        TICKS = 0 # restart ticks 
         self.player = AIShip(self) #re-initialize AIship
         self.playerGroup = sprite.Group(self.player)
         self.explosionsGroup = sprite.Group()
@@ -420,11 +574,12 @@ class SpaceInvaders(object):
         self.mysteryGroup = sprite.Group(self.mysteryShip)
         self.enemyBullets = sprite.Group()
         self.make_enemies()
-        self.allSprites = sprite.Group(self.player, self.enemies, self.livesGroup, self.mysteryShip)
+        hud = self.livesGroup if self.state_hud else ()
+        self.allSprites = sprite.Group(self.player, self.enemies, hud, self.mysteryShip)
         self.keys = key.get_pressed()
-        self.timer = get_time_ticks()
-        self.noteTimer = get_time_ticks()
-        self.shipTimer = get_time_ticks()
+        self.timer = self.get_time_ticks()
+        self.noteTimer = self.get_time_ticks()
+        self.shipTimer = self.get_time_ticks()
         self.score = score
         self.prev_score = score
         self.reward = score
@@ -436,20 +591,80 @@ class SpaceInvaders(object):
         self.mainScreen = True # reset game loop vars 
         self.gameOver = False # reset game loop vars 
 
-    def get_state(self, action=0): # to return state to agent
-        state = np.array(surfarray.array3d(self.screen)) # pygame frame
-        state = np.transpose(state, (1, 0, 2)) # to from yxc to xyc
-        state = cv2.cvtColor(state, cv2.COLOR_RGB2BGR) # from RGB to BGR
-        state = cv2.resize(state, (self.state_xres, self.state_yres), interpolation=cv2.INTER_CUBIC) # resize
-        state = state / 255.0 # normalizing from 0 to 1
-        state = np.transpose(state, (2, 0, 1)).astype(np.float32)
-        return state
+    def get_state(self, action=0, out=None): # to return state to agent
+        if self.frameDirty:
+            self.render()
+        if out is None:
+            out = np.empty((self.state_channels, self.state_yres, self.state_xres), dtype=self.state_dtype)
+        frame, bgr = self.frame_view() # pygame frame, no copy
+        if self.state_crop is not None:
+            top, bottom, left, right = self.state_crop
+            frame = frame[top:bottom, left:right]
+        if self.resized is None or self.resized.shape[2] != frame.shape[2]:
+            self.resized = np.empty((self.state_yres, self.state_xres, frame.shape[2]), dtype=np.uint8)
+        cv2.resize(frame, (self.state_xres, self.state_yres), dst=self.resized, interpolation=cv2.INTER_CUBIC) # resize
+        del frame # unlock screen
+        if self.state_grayscale and bgr == slice(0, 3):
+            state = cv2.cvtColor(self.resized, cv2.COLOR_BGRA2GRAY)[:, :, np.newaxis]
+        elif self.state_grayscale:
+            state = cv2.cvtColor(self.resized[:, :, bgr], cv2.COLOR_BGR2GRAY)[:, :, np.newaxis]
+        else:
+            state = self.resized[:, :, bgr] # to BGR
+        state = np.transpose(state, (2, 0, 1))
+        if out.dtype == np.uint8:
+            out[:] = state
+        else:
+            np.divide(state, 255.0, out=out, casting='unsafe') # normalizing from 0 to 1
+        return out
+
+    def get_symbolic_state(self, out=None): # compact state read from the sprites, no rendering
+        if out is None:
+            out = np.empty(SYMBOLIC_STATE_SIZE, dtype=np.float32)
+        out[:] = 0
+        field = {name: out[part] for name, part in SYMBOLIC_SLICES.items()}
+
+        field['ship'][:] = self.player.rect.x / 800, self.shipAlive
+        field['lives'][0] = len(self.livesGroup) / 3
+
+        field['enemies'][:] = self.enemies.alive.ravel()
+        if self.enemies:
+            field['enemies_offset'][:] = self.enemies.x / 800, self.enemies.y / 600
+
+        bullets = [(b.rect.x / 800, b.rect.y / 600, 1) for b in self.bullets.sprites()[:MAX_BULLETS]]
+        if bullets:
+            field['bullets'][:3 * len(bullets)] = np.ravel(bullets)
+        closest = sorted(self.enemyBullets, key=lambda b: -b.rect.y)[:MAX_ENEMY_BULLETS]
+        bullets = [(b.rect.x / 800, b.rect.y / 600, 1) for b in closest]
+        if bullets:
+            field['enemy_bullets'][:3 * len(bullets)] = np.ravel(bullets)
+
+        for mystery in self.mysteryGroup:
+            field['mystery'][:] = mystery.rect.x / 800, mystery.rect.y / 600, -75 < mystery.rect.x < 800
+
+        field['blockers'][[b.number * 36 + b.row * 9 + b.column for b in self.allBlockers]] = 1
+        return out
+
+    def frame_view(self): # screen pixels as (y, x, channel) array and its BGR channels
+        if self.screen.get_bytesize() == 4:
+            width, height = self.screen.get_size()
+            frame = np.frombuffer(self.screen.get_buffer(), dtype=np.uint8)
+            frame = frame.reshape(height, self.screen.get_pitch() // 4, 4)[:, :width]
+            shifts = self.screen.get_shifts()
+            channels = [shifts[c] // 8 for c in (2, 1, 0)]
+            if sys.byteorder == 'big':
+                channels = [3 - c for c in channels]
+            if channels == [0, 1, 2]:
+                return frame, slice(0, 3)
+            return frame, channels
+        frame = np.transpose(surfarray.pixels3d(self.screen), (1, 0, 2)) # to from yxc to xyc
+        return frame, [2, 1, 0]
 
     def make_blockers(self, number):
         blockerGroup = sprite.Group()
         for row in range(4):
             for column in range(9):
                 blocker = Blocker(10, GREEN, row, column, self)
+                blocker.number = number
                 blocker.rect.x = 50 + (200 * number) + (column * blocker.width)
                 blocker.rect.y = BLOCKERS_POSITION + (row * blocker.height)
                 blockerGroup.add(blocker)
@@ -523,20 +738,20 @@ class SpaceInvaders(object):
         for row in range(5):
             for column in range(10):
                 enemy = Enemy(row, column, self)
-                enemy.rect.x = 157 + (column * 50)
-                enemy.rect.y = self.enemyPosition + (row * 45)
+                enemy.rect.x = ENEMY_X_POSITION + (column * ENEMY_X_SPACING)
+                enemy.rect.y = self.enemyPosition + (row * ENEMY_Y_SPACING)
                 enemies.add(enemy)
 
         self.enemies = enemies
 
     def make_enemies_shoot(self):
-        if (get_time_ticks() - self.timer) > 700 and self.enemies:
+        if (self.get_time_ticks() - self.timer) > 700 and self.enemies:
             enemy = self.enemies.random_bottom()
             self.enemyBullets.add(
               Bullet(enemy.rect.x + 14, enemy.rect.y + 20, 1, 5,
                      'enemylaser', 'center', self))
             self.allSprites.add(self.enemyBullets)
-            self.timer = get_time_ticks()
+            self.timer = self.get_time_ticks()
 
     def calculate_score(self, row):
         scores = {0: 30,
@@ -544,7 +759,7 @@ class SpaceInvaders(object):
                   2: 20,
                   3: 10,
                   4: 10,
-                  5: choice([50, 100, 150, 300])
+                  5: self.random.choice([50, 100, 150, 300])
                   }
         score = scores[row]
         self.score += score
@@ -560,17 +775,17 @@ class SpaceInvaders(object):
         #           }
         reward = 0
 
-        sprite.groupcollide(self.bullets, self.enemyBullets, True, True)
+        collide_sprites(self.bullets.sprites(), self.enemyBullets.sprites(), True, True)
          
 
-        for enemy in sprite.groupcollide(self.enemies, self.bullets, True, True).keys():
+        for enemy in self.enemies.collide(self.bullets.sprites(), True, True).keys():
             #self.sounds['invaderkilled'].play()
             self.calculate_score(enemy.row)
             EnemyExplosion(enemy, self, self.explosionsGroup)
             reward += 1
-            self.gameTimer = get_time_ticks()
+            self.gameTimer = self.get_time_ticks()
 
-        for mystery in sprite.groupcollide(self.mysteryGroup, self.bullets, True, True).keys():
+        for mystery in collide_sprites(self.mysteryGroup.sprites(), self.bullets.sprites(), True, True).keys():
             #mystery.mysteryEntered.stop()
             #self.sounds['mysterykilled'].play()
             score = self.calculate_score(mystery.row)
@@ -580,7 +795,7 @@ class SpaceInvaders(object):
             self.mysteryGroup.add(newShip)
             reward += 1
 
-        for player in sprite.groupcollide(self.playerGroup, self.enemyBullets, True, True).keys():
+        for player in collide_sprites(self.playerGroup.sprites(), self.enemyBullets.sprites(), True, True).keys():
             # Always kill game
             # self.gameOver = True
             # self.startGame = False
@@ -600,11 +815,11 @@ class SpaceInvaders(object):
             #self.sounds['shipexplosion'].play()
             ShipExplosion(player, self, self.explosionsGroup)
             self.makeNewShip = True
-            self.shipTimer = get_time_ticks()
+            self.shipTimer = self.get_time_ticks()
             self.shipAlive = False
 
         if self.enemies.bottom >= 540:
-            sprite.groupcollide(self.enemies, self.playerGroup, True, True)
+            self.enemies.collide(self.playerGroup.sprites(), True, True)
             if not self.player.alive() or self.enemies.bottom >= 600:
                 self.gameOver = True
                 self.startGame = False
@@ -612,13 +827,25 @@ class SpaceInvaders(object):
         # for bullet, blocker in sprite.groupcollide(self.bullets, self.allBlockers, True, True).items():
         #     self.self_injury += 1
 
-        sprite.groupcollide(self.enemyBullets, self.allBlockers, True, True)
-        sprite.groupcollide(self.bullets, self.allBlockers, True, True)
+        blockers, blockerRects, bounds = self.blocker_rects()
+        collide_sprites(self.enemyBullets.sprites(), blockers, True, True, blockerRects, bounds)
+        blockers, blockerRects, bounds = self.blocker_rects()
+        collide_sprites(self.bullets.sprites(), blockers, True, True, blockerRects, bounds)
         if self.enemies.bottom >= BLOCKERS_POSITION:
-            sprite.groupcollide(self.enemies, self.allBlockers, False, True)
+            blockers, blockerRects, bounds = self.blocker_rects()
+            self.enemies.sync_sprites()
+            collide_sprites(self.enemies.sprites(), blockers, False, True, blockerRects, bounds)
 
         return reward
 
+    def blocker_rects(self): # blockers never move, their rects are collected again only after hits
+        if self.blockerCount != len(self.allBlockers):
+            self.blockerSprites = self.allBlockers.sprites()
+            self.blockerRects = [b.rect for b in self.blockerSprites]
+            self.blockerBounds = self.blockerRects[0].unionall(self.blockerRects) if self.blockerRects else None
+            self.blockerCount = len(self.blockerSprites)
+        return self.blockerSprites, self.blockerRects, self.blockerBounds
+
     def create_new_ship(self, createShip, currentTime):
         if createShip and (currentTime - self.shipTimer > 900):
             self.player = AIShip(self)
@@ -628,47 +855,204 @@ class SpaceInvaders(object):
             self.shipAlive = True
 
     def create_game_over(self, currentTime):
-        #self.screen.blit(self.background, (0, 0))
-        self.screen.fill((0, 0, 0))
         self.mainScreen = True
         #print("score: " + str(self.score), ", reward: " + str(self.reward))
 
     def start(self):
-        #self.screen.blit(self.background, (0, 0))
-        self.screen.fill((0, 0, 0))
-        self.titleText.draw(self.screen)
-        self.titleText2.draw(self.screen)
-        self.enemy1Text.draw(self.screen)
-        self.enemy2Text.draw(self.screen)
-        self.enemy3Text.draw(self.screen)
-        self.enemy4Text.draw(self.screen)
         self.allBlockers = sprite.Group(self.make_blockers(0),
           self.make_blockers(1),
           self.make_blockers(2),
           self.make_blockers(3))
+        self.blockerCount = None # see blocker_rects
         self.livesGroup.add(self.life1, self.life2, self.life3)
         self.enemyPosition = ENEMY_DEFAULT_POSITION
         self.reset(self.score)
         self.startGame = True
         self.mainScreen = False
+        self.frameDirty = True
+        if not self.headless:
+            self.render_title() # shown until the next step draws
+
+    def new_game(self): # same as reset(0) and start(), restored from a cached snapshot after the first call
+        if self.newGameSnapshot is None:
+            self.reset(0)
+            self.start()
+            self.newGameSnapshot = self.snapshot()
+        else:
+            self.restore(self.newGameSnapshot, rng=False)
+
+    def snapshot(self): # complete state of a started game as plain values, see restore
+        snap = {name: getattr(self, name, None) for name in SNAPSHOT_FIELDS}
+        snap['random'] = self.random.getstate()
+        lives = [self.life1, self.life2, self.life3]
+        groups = {'player': self.playerGroup.sprites(), 'lives': lives, 'mystery': self.mysteryGroup.sprites(),
+                  'bullets': self.bullets.sprites(), 'enemyBullets': self.enemyBullets.sprites()}
+        kinds = {s: (name, i) for name, sprites in groups.items() for i, s in enumerate(sprites)}
+        for enemy in self.enemies:
+            kinds[enemy] = ('enemies', enemy.row * self.enemies.columns + enemy.column)
+        snap['allSprites'] = [kinds[s] for s in self.allSprites] # draw order
+        snap['lives'] = [lives.index(life) for life in self.livesGroup]
+        snap['player'] = (self.player.rect.x, self.player.rect.y, self.player.fired,
+                          self.player in self.playerGroup)
+        snap['mystery'] = [(m.rect.x, m.rect.y, m.moveTime, m.direction, m.timer, m.playSound, m.missed)
+                           for m in groups['mystery']]
+        snap['bullets'], snap['enemyBullets'] = [
+            [(b.rect.x, b.rect.y, b.direction, b.speed, b.filename, b.side) for b in groups[name]]
+            for name in ('bullets', 'enemyBullets')]
+        explosions = []
+        for explosion in self.explosionsGroup:
+            if isinstance(explosion, EnemyExplosion):
+                explosions.append(('enemy', explosion.rect.x, explosion.rect.y, explosion.timer, explosion.row))
+            elif isinstance(explosion, MysteryExplosion):
+                explosions.append(('mystery', explosion.text.rect.x - 20, explosion.text.rect.y - 6,
+                                   explosion.timer, explosion.score))
+            else:
+                explosions.append(('ship', explosion.rect.x, explosion.rect.y, explosion.timer, None))
+        snap['explosions'] = explosions
+        snap['enemies'] = {name: getattr(self.enemies, name) for name in SNAPSHOT_ENEMIES_FIELDS}
+        snap['enemies']['alive'] = self.enemies.alive.copy()
+        snap['enemies']['_aliveColumns'] = list(self.enemies._aliveColumns)
+        blockers = np.zeros((4, 4, 9), dtype=bool) # number, row, column
+        for blocker in self.allBlockers:
+            blockers[blocker.number, blocker.row, blocker.column] = True
+        snap['blockers'] = blockers
+        return snap
+
+    def sprite_pools(self): # enemies and blockers made once and handed out again by restore
+        if self.enemyPool is None:
+            self.enemyPool = [Enemy(row, column, self) for row in range(5) for column in range(10)]
+            self.blockerPool = [blocker for number in range(4) for blocker in self.make_blockers(number)]
+        for s in self.enemyPool + self.blockerPool:
+            s.kill() # out of the groups of the previous restore
+        return self.enemyPool, self.blockerPool
+
+    def restore(self, snap, rng=True): # back to a snapshot, rng=False keeps the current random state
+        for name in SNAPSHOT_FIELDS:
+            setattr(self, name, snap[name])
+        if rng:
+            self.random.setstate(snap['random'])
+        enemyPool, blockerPool = self.sprite_pools()
+
+        x, y, fired, alive = snap['player']
+        self.player = AIShip(self)
+        self.player.rect.topleft = (x, y)
+        self.player.fired = fired
+        self.playerGroup = sprite.Group(self.player) if alive else sprite.Group()
+
+        mysteries = []
+        for x, y, moveTime, direction, timer, playSound, missed in snap['mystery']:
+            mystery = Mystery(self)
+            mystery.rect.topleft = (x, y)
+            mystery.moveTime, mystery.direction, mystery.timer = moveTime, direction, timer
+            mystery.playSound, mystery.missed = playSound, missed
+            mysteries.append(mystery)
+        self.mysteryShip = mysteries[0] if mysteries else Mystery(self)
+        self.mysteryGroup = sprite.Group(*mysteries)
+
+        bullets = {}
+        for name in ('bullets', 'enemyBullets'):
+            bullets[name] = [Bullet(x, y, direction, speed, filename, side, self)
+                             for x, y, direction, speed, filename, side in snap[name]]
+            setattr(self, name, sprite.Group(*bullets[name]))
 
-    def step(self, action): # run game step by step
-        global TICKS
+        self.explosionsGroup = sprite.Group()
+        for kind, x, y, timer, data in snap['explosions']:
+            source = sprite.Sprite() # what the explosions read from the exploded sprite
+            source.rect = Rect(x, y, 0, 0)
+            source.row = data
+            if kind == 'enemy':
+                explosion = EnemyExplosion(source, self, self.explosionsGroup)
+            elif kind == 'mystery':
+                explosion = MysteryExplosion(source, data, self, self.explosionsGroup)
+            else:
+                explosion = ShipExplosion(source, self, self.explosionsGroup)
+            explosion.timer = timer
+
+        self.enemies = EnemiesGroup(10, 5, self)
+        self.enemies.add(*[enemyPool[i] for i in np.flatnonzero(snap['enemies']['alive'])])
+        for name in SNAPSHOT_ENEMIES_FIELDS:
+            setattr(self.enemies, name, snap['enemies'][name])
+        self.enemies._aliveColumns = list(snap['enemies']['_aliveColumns'])
+        self.enemies.synced = False
+
+        self.allBlockers = sprite.Group(*[blockerPool[i] for i in np.flatnonzero(snap['blockers'])])
+        self.blockerCount = None # see blocker_rects
+
+        lives = [self.life1, self.life2, self.life3]
+        for life in lives:
+            life.kill()
+        self.livesGroup.add(*[lives[i] for i in snap['lives']])
+        groups = {'player': self.playerGroup.sprites(), 'lives': lives, 'mystery': mysteries,
+                  'bullets': bullets['bullets'], 'enemyBullets': bullets['enemyBullets'],
+                  'enemies': [enemy for enemyRow in self.enemies.enemies for enemy in enemyRow]}
+        self.allSprites = sprite.Group(*[groups[name][i] for name, i in snap['allSprites']])
+        self.keys = key.get_pressed()
+        self.frameDirty = True
 
+    def render(self): # draw current game state to screen
+        #self.screen.blit(self.background, (0, 0))
+        self.screen.fill((0, 0, 0))
+        if not self.mainScreen:
+            if self.state_hud:
+                scoreString = str(self.score) + "/" + str(self.reward)
+                if scoreString != self.scoreString:
+                    self.scoreText2 = Text(FONT, 20, scoreString, GREEN, 85, 5)
+                    self.scoreString = scoreString
+                self.scoreText.draw(self.screen)
+                self.scoreText2.draw(self.screen)
+                self.livesText.draw(self.screen)
+            if not self.enemies and not self.explosionsGroup:
+                self.nextRoundText.draw(self.screen)
+                if self.state_hud:
+                    self.livesGroup.draw(self.screen)
+            else:
+                self.enemies.sync_sprites()
+                self.allBlockers.draw(self.screen)
+                self.allSprites.draw(self.screen)
+                for explosion in self.explosionsGroup:
+                    explosion.draw(self.screen, self.currentTime)
+        self.frameDirty = False
+
+    def render_title(self): # title screen drawn by start
+        self.screen.fill((0, 0, 0))
+        for text in (self.titleText, self.titleText2, self.enemy1Text,
+                     self.enemy2Text, self.enemy3Text, self.enemy4Text):
+            text.draw(self.screen)
+        self.frameDirty = False
+
+    def get_time_ticks(self): # added ticks to forward the game
+        return self.ticks
+
+    def step(self, action, repeat=1, observe=True, max_pool=False): # run game step by step
+        # run `repeat` ticks with the same action (frame skipping) and build one state
+        # unless headless, each tick draws the screen where the original game did: bullets before
+        # they move, the score before the reward of the tick, nothing that collisions change
+        reward = 0
+        prevState = None
+        for i in range(repeat):
+            if max_pool and observe and i == repeat - 1 and i > 0:
+                prevState = self.get_state() # max over last two frames
+            reward += self.tick(action)
+            if self.gameOver:
+                break
+        state = None
+        if observe:
+            state = self.get_state()
+            if prevState is not None:
+                np.maximum(state, prevState, out=state)
+        return state, reward, self.gameOver
+
+    def draw(self, currentTime): # draw to screen mid tick unless headless, see step
+        if not self.headless:
+            self.currentTime = currentTime
+            self.render()
+
+    def tick(self, action): # advance game by one time step, returns reward
         if self.startGame:
             if not self.enemies and not self.explosionsGroup:
-                currentTime = get_time_ticks()
+                currentTime = self.get_time_ticks()
                 if currentTime - self.gameTimer < 3000:
-                    #self.screen.blit(self.background, (0, 0))
-                    self.screen.fill((0, 0, 0))
-                    self.scoreText2 = Text(FONT, 20,
-                                           str(self.score) + "/" + str(self.reward),
-                                           GREEN, 85, 5)
-                    self.scoreText.draw(self.screen)
-                    self.scoreText2.draw(self.screen)
-                    self.nextRoundText.draw(self.screen)
-                    self.livesText.draw(self.screen)
-                    self.livesGroup.update()
+                    self.draw(currentTime)
                     self.player.action_update(action) # agent action
                     self.check_input()
                 if currentTime - self.gameTimer > 3000:
@@ -678,21 +1062,16 @@ class SpaceInvaders(object):
                     self.start() # start again after player wins
                     self.gameTimer += 3000
             else:
-                currentTime = get_time_ticks()
+                currentTime = self.get_time_ticks()
                 #self.play_main_music(currentTime)
-                #self.screen.blit(self.background, (0, 0))
-                self.screen.fill((0, 0, 0))
-                self.allBlockers.update(self.screen)
-                self.scoreText2 = Text(FONT, 20,
-                                       str(self.score) + "/" + str(self.reward),
-                                       GREEN, 85, 5)
-                self.scoreText.draw(self.screen)
-                self.scoreText2.draw(self.screen)
-                self.livesText.draw(self.screen)
                 self.player.action_update(action)
                 self.check_input()
                 self.enemies.update(currentTime)
-                self.allSprites.update(self.keys, currentTime)
+                # only bullets and mystery ships move by themselves
+                self.mysteryGroup.update(self.keys, currentTime)
+                self.draw(currentTime) # bullets before they move, everything before collisions
+                self.bullets.update(self.keys, currentTime)
+                self.enemyBullets.update(self.keys, currentTime)
                 self.explosionsGroup.update(currentTime)
                 hits = self.check_collisions()
 
@@ -717,14 +1096,21 @@ class SpaceInvaders(object):
                 self.create_new_ship(self.makeNewShip, currentTime)
                 self.make_enemies_shoot()
         elif self.gameOver:
-            currentTime = get_time_ticks()
+            currentTime = self.get_time_ticks()
             # Reset enemy starting position
             self.enemyPosition = ENEMY_DEFAULT_POSITION
             self.create_game_over(currentTime)
-
-        display.update()
+            self.draw(currentTime)
+        else:
+            currentTime = self.get_time_ticks()
+
+        self.currentTime = currentTime
+        if self.headless:
+            self.frameDirty = True
+        else:
+            display.update()
         # passed_time = self.clock.tick(120)
-        #TICKS -= time.get_ticks() - self.delta_ticks
-        TICKS += self.TICKS_REF #time.get_ticks()
+        #self.ticks -= time.get_ticks() - self.delta_ticks
+        self.ticks += self.TICKS_REF #time.get_ticks()
         #GLOBAL_ID += 1
-        return self.get_state(), self.reward, self.gameOver 
+        return self.reward
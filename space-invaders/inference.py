@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Inference server batching action selection of many actors."""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, List
+
+import numpy as np
+import torch as t
+
+
+def stack_hidden(hiddens: List[Any]) -> Any:
+    """Returns per-actor hidden states batched on dim 1, None for fresh actors is zero."""
+    present = next((h for h in hiddens if h is not None), None)
+    if present is None:
+        return None
+    if isinstance(present, tuple):
+        return tuple(stack_hidden([None if h is None else h[i] for h in hiddens])
+                     for i in range(len(present)))
+    zeros = t.zeros_like(present)
+    return t.stack([zeros if h is None else h for h in hiddens], dim=1)
+
+
+def split_hidden(hidden: Any, n: int) -> List[Any]:
+    """Returns the per-actor hidden states of a hidden state batched on dim 1."""
+    if hidden is None:
+        return [None] * n
+    if isinstance(hidden, tuple):
+        return list(zip(*(split_hidden(h, n) for h in hidden)))
+    return list(hidden.unbind(dim=1))
+
+
+class InferenceServer:
+    """ Select actions for many actors with one batched forward pass.
+
+    Actors submit single states from any thread, a server thread waits for
+    the first request, collects more for up to `timeout` seconds, until
+    `max_batch` are queued or every actor seen so far is waiting, and answers
+    all of them with a single call of `forward`. The recurrent state of every actor is kept by the server and
+    fed back with its next request, `reset` starts an actor's new episode.
+
+    Each actor must wait for its action before submitting again.
+
+    Attributes:
+        model (t.nn.Module)
+        device (t.device)
+        forward (callable): (states, hidden) -> (q_values, hidden) of a batch
+        hidden (dict): recurrent state of each actor, None when fresh
+        lock (threading.Lock): held during forward passes, hold it to update the model
+
+    """
+
+    def __init__(
+        self,
+        model: t.nn.Module,
+        device: t.device,
+        forward: Callable = None,
+        max_batch: int = 64,
+        timeout: float = 0.002,
+    ):
+        """Initialization.
+
+        Args:
+            model (t.nn.Module): model whose greedy actions are returned
+            device (t.device): device of the model
+            forward (callable): one step of a batch of actors, states are stacked
+                on dim 0 and hidden states on dim 1, defaults to the model
+            max_batch (int): largest number of states per forward
+            timeout (float): seconds a request waits for others to join its batch
+
+        """
+        self.model = model
+        self.device = t.device(device)
+        self.forward = model if forward is None else forward
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.hidden: Dict[Hashable, Any] = {}
+        self.actors = set()  # actors that submitted so far
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.batches = 0  # forward passes so far
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, actor: Hashable, state: np.ndarray) -> Future:
+        """Queue the state of `actor`, the future resolves to its action."""
+        future = Future()
+        self.requests.put((actor, state, future))
+        return future
+
+    def act(self, actor: Hashable, state: np.ndarray) -> int:
+        """Returns the greedy action of `actor` for `state`."""
+        return self.submit(actor, state).result()
+
+    def reset(self, actor: Hashable):
+        """Forget the recurrent state of `actor`, e.g. at the end of its episode."""
+        self.hidden.pop(actor, None)
+
+    def _collect(self) -> List:
+        requests = [self.requests.get()]
+        end = time.perf_counter() + self.timeout
+        waiting = set()
+        while requests[-1] is not None:
+            waiting.add(requests[-1][0])
+            self.actors.add(requests[-1][0])
+            if len(requests) >= self.max_batch or len(waiting) == len(self.actors):
+                break
+            try:
+                requests.append(self.requests.get(timeout=max(end - time.perf_counter(), 0)))
+            except queue.Empty:
+                break
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            closed = requests[-1] is None
+            requests = [r for r in requests if r is not None]
+            if requests:
+                actors, states, futures = zip(*requests)
+                try:
+                    actions = self._forward(actors, states)
+                except BaseException as e:
+                    for future in futures:
+                        future.set_exception(e)
+                else:
+                    for future, action in zip(futures, actions):
+                        future.set_result(int(action))
+            if closed:
+                return
+
+    def _forward(self, actors, states) -> np.ndarray:
+        batch = t.from_numpy(np.stack(states)).to(self.device, non_blocking=True)
+        hidden = stack_hidden([self.hidden.get(actor) for actor in actors])
+        with self.lock, t.no_grad():
+            q_values, hidden = self.forward(batch, hidden)
+        for actor, h in zip(actors, split_hidden(hidden, len(actors))):
+            self.hidden[actor] = h
+        self.batches += 1
+        return q_values.argmax(dim=1).cpu().numpy()
+
+    def close(self):
+        """Answer the queued requests and stop the server thread."""
+        self.requests.put(None)
+        self.thread.join(timeout=5)
@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+"""Append-only metrics log keeping bounded aggregates in memory."""
+
+import glob
+import json
+import math
+import os
+from collections import defaultdict, deque
+from typing import Dict, List, Optional
+
+SUMMARY = "summary.json"
+
+
+class FieldSummary:
+    """ Running aggregates of one metric.
+
+    Besides the totals it keeps the latest `window` values and the means of
+    consecutive blocks of `block` values. When `max_blocks` blocks are full
+    neighbouring blocks are merged and the block size doubles, so memory
+    stays bounded however long training runs.
+
+    Attributes:
+        count (int): values added so far
+        total (float): sum of the values
+        min (float): smallest value, None before the first one
+        max (float): largest value, None before the first one
+        last (float): latest value, None before the first one
+        window (deque): latest values
+        block (int): values per block mean
+        blocks (list): means of the full blocks, oldest first
+
+    """
+
+    def __init__(self, window: int = 1000, block: int = 100, max_blocks: int = 1000):
+        """Initialization.
+
+        Args:
+            window (int): number of latest values kept
+            block (int): initial number of values per block mean
+            max_blocks (int): even number of block means kept
+
+        """
+        assert max_blocks >= 2 and max_blocks % 2 == 0
+        self.count = 0
+        self.total = 0.0
+        self.min = self.max = self.last = None
+        self.window = deque(maxlen=window)
+        self.block = block
+        self.blocks: List[float] = []
+        self.max_blocks = max_blocks
+        self.partial_total, self.partial_count = 0.0, 0
+
+    def add(self, value: float):
+        """Add a value to the aggregates."""
+        value = float(value)
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.last = value
+        self.window.append(value)
+
+        self.partial_total += value
+        self.partial_count += 1
+        if self.partial_count == self.block:
+            self.blocks.append(self.partial_total / self.block)
+            self.partial_total, self.partial_count = 0.0, 0
+            if len(self.blocks) == self.max_blocks:
+                self.blocks = [(a + b) / 2 for a, b in zip(self.blocks[::2], self.blocks[1::2])]
+                self.block *= 2
+
+    def mean(self) -> float:
+        """Mean of all values, nan before the first one."""
+        return self.total / self.count if self.count else math.nan
+
+    def state(self) -> Dict:
+        """Aggregates as a json serializable dict."""
+        state = dict(vars(self))
+        state["window"] = list(self.window)
+        state["window_size"] = self.window.maxlen
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "FieldSummary":
+        """Returns the summary saved by `state`."""
+        state = dict(state)
+        summary = cls(state.pop("window_size"), state["block"], state["max_blocks"])
+        summary.window.extend(state.pop("window"))
+        vars(summary).update(state)
+        return summary
+
+
+class MetricsLog:
+    """ Append-only log of training metrics.
+
+    Every record has a kind, e.g. "train" or "episode", and numeric fields.
+    Records are appended as json lines to segment files in `path`, each run
+    starts a new segment and segments are rotated every `segment_size`
+    records. In memory only a `FieldSummary` of every field is kept.
+
+    `flush` writes pending records and atomically saves the summaries to
+    `summary.json`, reopening the log reads nothing else. Records appended
+    after the last flush are not counted by the summaries, reopening drops
+    them from the segments so readers and `read_history` agree with the
+    summaries. Full histories are rebuilt offline with `read_history`.
+    Without a `path` nothing is written.
+
+    Attributes:
+        path (str): directory of the log, None keeps it in memory
+        counts (dict): number of records of each kind
+        fields (dict): summaries of the fields of each kind
+
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        window: int = 1000,
+        block: int = 100,
+        max_blocks: int = 1000,
+        segment_size: int = 100_000,
+    ):
+        """Initialization.
+
+        Args:
+            path (str): directory of the log, None keeps it in memory
+            window (int): number of latest values kept of every field
+            block (int): initial number of values per block mean
+            max_blocks (int): number of block means kept of every field
+            segment_size (int): records per segment file
+
+        """
+        self.path = path
+        self.segment_size = segment_size
+        self.new_summary = lambda: FieldSummary(window, block, max_blocks)
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.fields: Dict[str, Dict[str, FieldSummary]] = defaultdict(dict)
+        self.file = None
+        self.segment = 0
+        self.segment_records = 0
+
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            summary = load_summary(path)
+            if summary is not None:
+                self._restore(summary)
+                if "position" in summary:
+                    self._truncate(*summary["position"])
+            self.segment = len(segment_files(path))
+
+    def log(self, kind: str, **values: float):
+        """Append a record of `kind` with the given field values."""
+        values = {field: getattr(value, "item", lambda: value)() for field, value in values.items()}
+        self.counts[kind] += 1
+        fields = self.fields[kind]
+        for field, value in values.items():
+            if field not in fields:
+                fields[field] = self.new_summary()
+            fields[field].add(value)
+
+        if self.path is not None:
+            if self.file is None or self.segment_records == self.segment_size:
+                self._open_segment()
+            self.file.write(json.dumps(dict(kind=kind, **values)) + "\n")
+            self.segment_records += 1
+
+    def summary(self, kind: str, field: str) -> FieldSummary:
+        """Returns the aggregates of a field, empty if it was never logged."""
+        return self.fields.get(kind, {}).get(field) or self.new_summary()
+
+    def flush(self):
+        """Write pending records and the summaries to disk."""
+        if self.path is None:
+            return
+        if self.file is not None:
+            self.file.flush()
+        summary = dict(
+            counts=self.counts,
+            fields={kind: {field: s.state() for field, s in fields.items()}
+                    for kind, fields in self.fields.items()},
+            position=[self.segment, 0 if self.file is None else self.file.tell()],
+        )
+        file = os.path.join(self.path, SUMMARY)
+        with open(file + ".tmp", "w") as f:
+            json.dump(summary, f)
+        os.replace(file + ".tmp", file)
+
+    def close(self):
+        """Flush and close the current segment."""
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _restore(self, summary: Dict):
+        self.counts.update(summary["counts"])
+        for kind, fields in summary["fields"].items():
+            for field, state in fields.items():
+                self.fields[kind][field] = FieldSummary.from_state(state)
+
+    def _truncate(self, segment: int, offset: int):
+        # records past the flushed position, e.g. of a crashed run, are dropped
+        for file in segment_files(self.path)[segment + 1:]:
+            os.remove(file)
+        file = segment_file(self.path, segment)
+        if os.path.exists(file):
+            if offset > 0:
+                os.truncate(file, offset)
+            else:
+                os.remove(file)
+
+    def _open_segment(self):
+        if self.file is not None:
+            self.file.close()
+            self.segment += 1
+        self.file = open(segment_file(self.path, self.segment), "a")
+        self.segment_records = 0
+
+
+class MetricsReader:
+    """ Incremental reader of a `MetricsLog`, e.g. in another process.
+
+    The first `poll` starts from the summaries saved by the last flush of the
+    log, later ones only parse the records appended since the previous one,
+    so the aggregates follow those of the writer without rereading history.
+
+    Attributes:
+        path (str): directory of the log
+        counts (dict): number of records of each kind
+        fields (dict): summaries of the fields of each kind
+        position (list): segment and byte offset of the next record
+
+    """
+
+    def __init__(self, path: str, window: int = 1000, block: int = 100, max_blocks: int = 1000):
+        """Initialization.
+
+        Args:
+            path (str): directory of the log
+            window (int): number of latest values kept of every field
+            block (int): initial number of values per block mean
+            max_blocks (int): number of block means kept of every field
+
+        """
+        self.path = path
+        self.aggregates = MetricsLog(None, window, block, max_blocks)
+        self.counts = self.aggregates.counts
+        self.fields = self.aggregates.fields
+        self.position: Optional[List[int]] = None
+
+    def summary(self, kind: str, field: str) -> FieldSummary:
+        """Returns the aggregates of a field, empty if it was never logged."""
+        return self.aggregates.summary(kind, field)
+
+    def poll(self) -> int:
+        """Read the records written since the last call, returns their number."""
+        if self.position is None:
+            summary = load_summary(self.path)
+            self.position = [0, 0]
+            # summaries saved without their position are rebuilt from the segments
+            if summary is not None and "position" in summary:
+                self.aggregates._restore(summary)
+                self.position = list(summary["position"])
+
+        records = 0
+        while True:
+            file = segment_file(self.path, self.position[0])
+            if os.path.exists(file):
+                with open(file, "rb") as f:
+                    f.seek(self.position[1])
+                    data = f.read()
+                # a line without its newline is still being written
+                end = data.rfind(b"\n") + 1
+                for line in data[:end].splitlines():
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.aggregates.log(record.pop("kind"), **record)
+                    records += 1
+                self.position[1] += end
+            # a segment is complete once the next one exists
+            if not os.path.exists(segment_file(self.path, self.position[0] + 1)):
+                return records
+            self.position = [self.position[0] + 1, 0]
+
+
+def segment_file(path: str, segment: int) -> str:
+    """Returns the file of a segment of the log in `path`."""
+    return os.path.join(path, "metrics-{:05d}.jsonl".format(segment))
+
+
+def segment_files(path: str) -> List[str]:
+    """Returns the segment files of the log in `path`, oldest first."""
+    return sorted(glob.glob(os.path.join(path, "metrics-*.jsonl")))
+
+
+def load_summary(path: str) -> Optional[Dict]:
+    """Returns the summaries saved by the last flush of the log in `path`, None if there are none."""
+    file = os.path.join(path, SUMMARY)
+    if not os.path.exists(file):
+        return None
+    with open(file, "r") as f:
+        return json.load(f)
+
+
+def read_history(path: str) -> Dict[str, Dict[str, List[float]]]:
+    """Returns every logged value of the log in `path` as lists per kind and field.
+
+    Lines cut short by a crash are skipped.
+    """
+    history: Dict[str, Dict[str, List[float]]] = defaultdict(lambda: defaultdict(list))
+    for file in segment_files(path):
+        with open(file, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                fields = history[record.pop("kind")]
+                for field, value in record.items():
+                    fields[field].append(value)
+    return {kind: dict(fields) for kind, fields in history.items()}
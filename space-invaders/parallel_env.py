@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""Subprocess environment pool writing observations to shared memory."""
+
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+from typing import Tuple
+
+import numpy as np
+
+
+def _worker(
+    index: int,
+    remote,
+    shm_name: str,
+    shape: Tuple[int, ...],
+    state_xres: int,
+    state_yres: int,
+    ticks_ref: int,
+    frame_skip: int,
+    screen_size: Tuple[int, int],
+    seed: int,
+):
+    """Run one SpaceInvaders game and serve commands from the parent."""
+    # every worker owns its own SDL dummy display
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+    os.environ["PYGAME_HIDE_SUPPORT_PROMPT"] = "1"
+    import cv2
+    import pygame
+    cv2.setNumThreads(1)  # one core per worker, avoid oversubscription
+    screen = pygame.display.set_mode(screen_size)
+    from game_v2 import SpaceInvaders
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    obs = np.ndarray(shape, dtype=np.float32, buffer=shm.buf)[index]
+    game = SpaceInvaders(screen, None, state_xres, state_yres, ticks_ref, headless=True, seed=seed)
+    try:
+        while True:
+            cmd, data = remote.recv()
+            if cmd == "step":
+                _, reward, done = game.step(action=data, repeat=frame_skip, observe=False)
+                score = game.score
+                if done:
+                    game.new_game()
+                game.get_state(out=obs)
+                remote.send((reward, done, score))
+            elif cmd == "reset":
+                game.new_game()
+                game.get_state(out=obs)
+                remote.send(None)
+            elif cmd == "close":
+                break
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        del obs
+        shm.close()
+        remote.close()
+
+
+class ParallelSpaceInvadersEnv:
+    """ Step N SpaceInvaders games, each in its own process.
+
+    Workers write observations straight into a shared-memory array, only
+    actions and (reward, done, score) tuples go through the pipes. A worker
+    that dies is restarted with a new seed and its game is reported as done.
+
+    Attributes:
+        num_envs (int)
+        obs_buf (np.ndarray): shared observations, shape (N, 3, H, W)
+        last_scores (np.ndarray): score of each game at its last episode end
+        restarts (int): number of worker restarts so far
+        max_retries (int): attempts to restart a worker before giving up
+
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        state_xres: int,
+        state_yres: int,
+        ticks_ref: int,
+        frame_skip: int = 1,
+        screen_size: Tuple[int, int] = (800, 600),
+        start_method: str = "spawn",
+        seed: int = None,
+        max_retries: int = 3,
+    ):
+        """Initialization.
+
+        Args:
+            num_envs (int): number of worker processes
+            state_xres (int): observation width
+            state_yres (int): observation height
+            ticks_ref (int): game time advanced per tick
+            frame_skip (int): game ticks per step, rewards are summed
+            screen_size (tuple): size of each worker display
+            start_method (str): multiprocessing start method
+            seed (int): game i is seeded with seed + i, None leaves games unseeded.
+                A restarted game gets seed + i + num_envs * restarts
+            max_retries (int): attempts to restart a dead worker, then RuntimeError
+
+        """
+        assert num_envs > 0
+        self.num_envs = num_envs
+        self.ctx = mp.get_context(start_method)
+        self.shape = (num_envs, 3, state_yres, state_xres)
+        nbytes = int(np.prod(self.shape)) * np.dtype(np.float32).itemsize
+        self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.obs_buf = np.ndarray(self.shape, dtype=np.float32, buffer=self.shm.buf)
+        self.obs_buf[:] = 0
+        self.last_scores = np.zeros([num_envs], dtype=np.int64)
+        self.restarts = 0
+        self.max_retries = max_retries
+        self.seed = seed
+        self.closed = False
+        self.worker_args = (self.shm.name, self.shape, state_xres, state_yres,
+                            ticks_ref, frame_skip, screen_size)
+        self.remotes = [None] * num_envs
+        self.processes = [None] * num_envs
+        for i in range(num_envs):
+            self._start_worker(i)
+
+    def _start_worker(self, index: int):
+        # a restarted game must not replay the episodes of the one it replaces
+        seed = None if self.seed is None else self.seed + index + self.num_envs * self.restarts
+        remote, work_remote = self.ctx.Pipe()
+        process = self.ctx.Process(
+            target=_worker, args=(index, work_remote) + self.worker_args + (seed,), daemon=True
+        )
+        process.start()
+        work_remote.close()
+        self.remotes[index] = remote
+        self.processes[index] = process
+
+    def _restart_worker(self, index: int):
+        for _ in range(self.max_retries):
+            self.remotes[index].close()
+            self.processes[index].join(timeout=1)
+            if self.processes[index].is_alive():
+                self.processes[index].terminate()
+            self.restarts += 1
+            self._start_worker(index)
+            try:
+                self.remotes[index].send(("reset", None))
+                self.remotes[index].recv()
+                return
+            except (EOFError, ConnectionError) as e:
+                error = e
+        raise RuntimeError(
+            "worker {} died again after each of {} restarts".format(index, self.max_retries)
+        ) from error
+
+    def reset(self) -> np.ndarray:
+        """Start a new episode in every game and return the observations."""
+        for remote in self.remotes:
+            remote.send(("reset", None))
+        for i, remote in enumerate(self.remotes):
+            try:
+                remote.recv()
+            except (EOFError, ConnectionError):
+                self._restart_worker(i)
+        return self.obs_buf.copy()
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Apply one action per game.
+
+        Args:
+            actions (np.ndarray): shape (N,)
+
+        Returns:
+            observations (N, 3, H, W), rewards (N,) and done flags (N,)
+
+        """
+        assert len(actions) == self.num_envs
+        rews = np.zeros([self.num_envs], dtype=np.float32)
+        dones = np.zeros([self.num_envs], dtype=bool)
+        sent = []
+        for i, (remote, action) in enumerate(zip(self.remotes, actions)):
+            try:
+                remote.send(("step", int(action)))
+                sent.append(i)
+            except (BrokenPipeError, ConnectionError):
+                self._restart_worker(i)
+                dones[i] = True
+        for i in sent:
+            try:
+                rews[i], dones[i], score = self.remotes[i].recv()
+            except (EOFError, ConnectionError):
+                # crashed worker: lose its episode and start a fresh one
+                self._restart_worker(i)
+                dones[i] = True
+                continue
+            if dones[i]:
+                self.last_scores[i] = score
+        return self.obs_buf.copy(), rews, dones
+
+    def close(self):
+        """Stop the workers and release the shared memory."""
+        if self.closed:
+            return
+        for remote in self.remotes:
+            try:
+                remote.send(("close", None))
+            except (BrokenPipeError, ConnectionError):
+                pass
+        for remote, process in zip(self.remotes, self.processes):
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+            remote.close()
+        del self.obs_buf
+        self.shm.close()
+        self.shm.unlink()
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self) -> int:
+        return self.num_envs
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""Background sampler preparing prioritized replay batches ahead of training."""
+
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import torch as t
+
+from replay_buffer import PrioritizedReplayBuffer
+
+
+class PrefetchSampler:
+    """ Sample the next PER batch while the current one is trained on.
+
+    A thread samples indices from `memory`, gathers the transitions, and
+    their n-step returns when `n_step` is given, or the sequences straight
+    into preallocated tensors (pinned when the device is a GPU) and copies them to the device on a side stream. Batches rotate
+    through `slots` buffers and a slot is refilled only after the trainer
+    asked for the following batch, so tensors in use are never overwritten.
+
+    The buffer is not thread safe, `store` and `update_priorities` must go
+    through the sampler, they hold the same lock as sampling. Every batch
+    after the first `slots - 1` is sampled only once the priorities of an
+    earlier one were updated, with the default two slots the next batch sees
+    the update of the current one. A store waits for a batch that can be
+    sampled, so batches do not depend on thread timing.
+
+    Sampling draws from the sampler's own random state, seeded from the
+    global numpy one unless `seed` is given. `state_dict` holds it as it was
+    before the batches not yet handed to the trainer, so a restored sampler
+    draws them again, from the memory as it is restored.
+
+    Attributes:
+        memory (PrioritizedReplayBuffer)
+        device (t.device)
+        beta (float): importance sampling exponent used for the next samples
+        n_step (int): horizon of the n-step batch, None for none
+        rng (np.random.RandomState): random state of the sampling
+        lock (threading.Condition): guards the buffer and the slots
+
+    """
+
+    def __init__(
+        self,
+        memory: PrioritizedReplayBuffer,
+        device: t.device,
+        beta: float = 0.4,
+        slots: int = 2,
+        n_step: Optional[int] = None,
+        seed: Optional[int] = None,
+    ):
+        """Initialization.
+
+        Args:
+            memory (PrioritizedReplayBuffer)
+            device (t.device): device the batches are copied to
+            beta (float): initial importance sampling exponent
+            slots (int): number of batches prepared or in use at a time
+            n_step (int): horizon of the n-step returns computed with each batch
+            seed (int): seed of the sampling, None draws it from np.random
+
+        """
+        assert slots >= 2
+        self.memory = memory
+        self.n_step = n_step
+        self.device = t.device(device)
+        self.beta = beta
+        self.rng = np.random.RandomState(np.random.randint(2 ** 31) if seed is None else seed)
+        self.lock = threading.Condition()
+        self.cuda = self.device.type == "cuda"
+        self.stream = t.cuda.Stream(self.device) if self.cuda else None
+
+        shapes = [memory.batch_shapes()]
+        if n_step is not None:
+            shapes.append(memory.n_step_shapes())
+        self.host, self.host_arrays, self.batches = [], [], []
+        self.copied, self.released = [], []
+        for _ in range(slots):
+            host = [{k: t.empty(shape, pin_memory=self.cuda) for k, shape in s.items()} for s in shapes]
+            if self.cuda:
+                batch = [{k: v.to(self.device) for k, v in h.items()} for h in host]
+            else:
+                batch = host
+            self.host.append(host)
+            self.host_arrays.append([{k: v.numpy() for k, v in h.items()} for h in host])
+            self.batches.append(batch)
+            self.copied.append(t.cuda.Event() if self.cuda else None)
+            self.released.append(t.cuda.Event() if self.cuda else None)
+
+        # batches that may be sampled before the next priority update
+        self.credits = slots - 1
+        self.free = list(range(slots))
+        # sampled batches not handed out yet: slot, indices, random state and beta before sampling
+        self.ready = []
+        self.sampling = None
+        self.generation = 0
+        self.current = None
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def store(self, *transition):
+        """Store a transition, or a step with its recurrent state, in memory."""
+        with self.lock:
+            while self._due() and not self.closed and self.error is None:
+                self.lock.wait()
+            self.memory.store(*transition)
+            self.lock.notify_all()
+
+    def update_priorities(self, indices: np.ndarray, priorities: np.ndarray):
+        """Update priorities of a trained batch, the next one is sampled after."""
+        with self.lock:
+            self.memory.update_priorities(indices, priorities)
+            self.credits += 1
+            self.lock.notify_all()
+
+    def get(self, beta: float = None) -> Tuple[Dict[str, t.Tensor], Dict[str, t.Tensor], np.ndarray]:
+        """Returns the next batch, its n-step batch (None without n_step) and their indices.
+
+        The tensors stay valid until the following call.
+        """
+        with self.lock:
+            if beta is not None:
+                self.beta = beta
+            if self.current is not None:
+                if self.cuda:
+                    # kernels still reading the previous batch run before its refill
+                    self.released[self.current].record(t.cuda.current_stream(self.device))
+                self.free.append(self.current)
+                self.current = None
+                self.lock.notify_all()
+
+            while not self.ready and self.error is None:
+                if self.credits == 0 and self.sampling is None:
+                    raise RuntimeError("update_priorities must follow every batch before the next one")
+                self.lock.wait()
+            if self.error is not None:
+                raise self.error
+            slot, indices, _, _ = self.ready.pop(0)
+            self.current = slot
+
+        if self.cuda:
+            t.cuda.current_stream(self.device).wait_event(self.copied[slot])
+        samples, samples_n = (self.batches[slot] + [None])[:2]
+        return samples, samples_n, indices
+
+    def state_dict(self) -> Dict:
+        """Random state and beta the batches not handed out yet were sampled with."""
+        with self.lock:
+            pending = self.ready[0][2:] if self.ready else self.sampling
+            rng, beta = pending if pending is not None else (self.rng.get_state(), self.beta)
+            return dict(rng=rng, beta=beta)
+
+    def load_state_dict(self, state: Dict):
+        """Drop the batches not handed out yet and sample from `state` again."""
+        with self.lock:
+            self.generation += 1
+            for slot, _, _, _ in self.ready:
+                self.free.append(slot)
+                self.credits += 1
+            self.ready = []
+            self.rng.set_state(state["rng"])
+            self.beta = state["beta"]
+            self.lock.notify_all()
+
+    def _due(self) -> bool:
+        """True when a batch can be sampled."""
+        return (
+            self.sampling is None and self.credits > 0 and len(self.free) > 0
+            and len(self.memory) >= self.memory.batch_size
+        )
+
+    def _run(self):
+        try:
+            while True:
+                with self.lock:
+                    while not self._due() and not self.closed:
+                        self.lock.wait()
+                    if self.closed:
+                        return
+                    slot = self.free.pop(0)
+                    self.credits -= 1
+                    generation = self.generation
+                    self.sampling = (self.rng.get_state(), self.beta)
+                    out = self.host_arrays[slot]
+                    if self.cuda:
+                        self.copied[slot].synchronize()  # previous copy out of the pinned slot
+                    indices = self.memory.sample_batch(self.beta, out=out[0], rng=self.rng)["indices"]
+                    if self.n_step is not None:
+                        self.memory.sample_n_step(indices, [self.n_step], out=out[1:])
+
+                if self.cuda:
+                    with t.cuda.stream(self.stream):
+                        self.stream.wait_event(self.released[slot])
+                        for h, d in zip(self.host[slot], self.batches[slot]):
+                            for k in h:
+                                d[k].copy_(h[k], non_blocking=True)
+                        self.copied[slot].record(self.stream)
+
+                with self.lock:
+                    if generation == self.generation:
+                        self.ready.append((slot, indices) + self.sampling)
+                    else:
+                        # dropped by load_state_dict while it was copied
+                        self.free.append(slot)
+                        self.credits += 1
+                    self.sampling = None
+                    self.lock.notify_all()
+        except BaseException as e:
+            with self.lock:
+                self.error = e
+                self.sampling = None
+                self.lock.notify_all()
+
+    def close(self):
+        """Stop the sampling thread."""
+        with self.lock:
+            self.closed = True
+            self.lock.notify_all()
+        self.thread.join(timeout=5)
@@ -0,0 +1,730 @@
+# -*- coding: utf-8 -*-
+"""Replay buffers with a shared uint8 frame store, optionally kept on disk."""
+
+import json
+import os
+from collections import deque
+from typing import Deque, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from segment_tree import MinSegmentTree, SumSegmentTree
+
+# uint8 pixel -> float32 state, same values as the game's get_state
+PIXEL_TO_STATE = (np.arange(256) / 255.0).astype(np.float32)
+
+# slots or frames an on-disk buffer may write past its last flush before
+# meta.json records how far writes can have reached, at most a 16th of the buffer
+RESERVE = 1024
+
+
+def reserve_step(size: int) -> int:
+    """Returns how far ahead of the writes a buffer of `size` slots reserves."""
+    return max(1, min(RESERVE, size // 16))
+
+
+def open_array(
+    path: str, name: str, shape: Tuple[int, ...], dtype: type, fill: float = 0
+) -> np.ndarray:
+    """Returns array memory mapped from `path/name.npy`, in RAM if path is None.
+
+    An existing file is reopened as is, otherwise it is created with `fill`.
+    """
+    if path is None:
+        return np.full(shape, fill, dtype=dtype)
+
+    file = os.path.join(path, name + ".npy")
+    if os.path.exists(file):
+        array = np.lib.format.open_memmap(file, mode="r+")
+        assert array.shape == tuple(shape) and array.dtype == dtype, \
+            "{} has shape {} {}, expected {} {}".format(
+                file, array.shape, array.dtype, tuple(shape), np.dtype(dtype))
+        return array
+
+    os.makedirs(path, exist_ok=True)
+    array = np.lib.format.open_memmap(file, mode="w+", dtype=dtype, shape=tuple(shape))
+    if fill != 0:
+        array[:] = fill
+    return array
+
+
+def load_meta(path: str) -> Dict:
+    """Returns the saved pointers of a buffer in `path`, empty if there are none."""
+    if path is None or not os.path.exists(os.path.join(path, "meta.json")):
+        return {}
+    with open(os.path.join(path, "meta.json"), "r") as f:
+        return json.load(f)
+
+
+def save_meta(path: str, meta: Dict):
+    """Atomically write the pointers of a buffer to `path`."""
+    file = os.path.join(path, "meta.json")
+    with open(file + ".tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(file + ".tmp", file)
+
+
+class FrameBuffer:
+    """ Ring of uint8 frames shared by replay buffers.
+
+    Each frame is stored once and referenced by an ever increasing frame id,
+    so obs[i + 1] and next_obs[i] share the same slot: a frame added as a
+    repeat of an earlier id gets that id back if their pixels are equal.
+
+    With a `path` the frames are memory mapped from disk and `flush` saves
+    them, reopening the same path resumes the buffer. Frames added after
+    the last flush overwrote the oldest ones, meta.json records which ids
+    they could have taken and a reopened buffer continues after them, so
+    the frames they overwrote count as overwritten.
+
+    Attributes:
+        frames (np.ndarray): uint8 frames, shape (size, *obs_dim)
+        size (int): number of frame slots
+        count (int): number of frames added so far
+
+    """
+
+    def __init__(self, obs_dim: Tuple[int, ...], size: int, path: str = None):
+        """Initialization.
+
+        Args:
+            obs_dim (tuple): shape of one state
+            size (int): number of frame slots
+            path (str): directory of the on-disk buffer, None keeps it in RAM
+
+        """
+        self.path = path
+        self.frames = open_array(path, "frames", [size, *obs_dim], np.uint8)
+        self.size = size
+        meta = load_meta(path)
+        # ids up to `reserved` may have been taken after the flush of `count`
+        self.count = max(meta.get("count", 0), meta.get("reserved", 0))
+        self.flushed = self.reserved = self.count
+
+    def add(self, frame: np.ndarray, previous: int = None) -> int:
+        """Store frame and return its id, `previous` if the frame with that id has the same pixels."""
+        if frame.dtype != np.uint8:
+            frame = np.rint(frame * 255.0).astype(np.uint8)
+        if (
+            previous is not None and previous >= self.count - self.size
+            and np.array_equal(self.frames[previous % self.size], frame)
+        ):
+            return previous
+
+        frame_id = self.count
+        if self.path is not None and frame_id >= self.reserved:
+            self.reserved = frame_id + reserve_step(self.size)
+            save_meta(self.path, dict(count=self.flushed, reserved=self.reserved))
+        self.frames[frame_id % self.size] = frame
+        self.count += 1
+        return frame_id
+
+    def get(self, frame_ids: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+        """Return float32 states for the given frame ids, written to `out` if given."""
+        assert np.min(frame_ids) >= self.count - self.size, "frame was overwritten, increase size"
+        return np.take(PIXEL_TO_STATE, self.frames[frame_ids % self.size], out=out)
+
+    def flush(self):
+        """Write frames and frame count to disk."""
+        if self.path is not None:
+            self.frames.flush()
+            save_meta(self.path, dict(count=self.count))
+            self.flushed = self.reserved = self.count
+
+    def __len__(self) -> int:
+        return min(self.count, self.size)
+
+
+class ReplayBuffer:
+    """A simple numpy replay buffer.
+
+    Frames live in a `FrameBuffer` that can be shared with other buffers,
+    the buffer itself only keeps frame ids. The next state of a terminal
+    transition is not stored, its state is returned instead since the
+    target is masked by done.
+
+    N-step returns can be computed at sample time by `sample_n_step` from
+    the 1-step transitions, for any number of horizons, instead of storing
+    them with `n_step` > 1. Transition i + 1 follows transition i when its
+    state is the next state of i: a state with the same pixels as the next
+    state stored before it reuses that frame, whichever array holds it.
+
+    With a `path` all arrays are memory mapped from disk and `flush` saves
+    the ring pointers, reopening the same path resumes the buffer as of the
+    last flush. Transitions still waiting in the n-step queue are not saved.
+    Slots written after the last flush, up to the reserve meta.json records
+    ahead of the writes, and slots whose frames were overwritten are `lost`:
+    their frame ids are reset so n-step returns stop before them, and a
+    prioritized buffer never samples them.
+
+    With `window` > 1 a sampled state is the stack of the last `window`
+    frames up to it, shape (window * obs_dim[0], *obs_dim[1:]). Frames are
+    then added in the order they are stored so that the frames of an episode
+    have consecutive ids, and windows reaching before the first frame of the
+    episode repeat that frame. Transitions must be stored in episode order
+    by a single actor.
+
+    """
+
+    def __init__(
+        self,
+        obs_dim: Tuple[int, ...],
+        size: int,
+        batch_size: int = 32,
+        n_step: int = 1,
+        gamma: float = 0.99,
+        frames: FrameBuffer = None,
+        path: str = None,
+        window: int = 1,
+    ):
+        self.own_frames = frames is None
+        if frames is None:
+            frames_path = None if path is None else os.path.join(path, "frames")
+            frames = FrameBuffer(obs_dim, size + 2 * n_step + 1 + window, path=frames_path)
+        assert frames.frames.shape[1:] == tuple(obs_dim)
+        self.frames = frames
+        self.path = path
+        self.window = window
+        self.obs_shape = (window * obs_dim[0], *obs_dim[1:])
+        self._open_buffers(path, size)
+        self.max_size, self.batch_size = size, batch_size
+        meta = load_meta(path)
+        self.ptr, self.size, = meta.get("ptr", 0), meta.get("size", 0)
+        # slots from ptr up to `reserved` may have been written after the last flush
+        self.flushed, self.unflushed, self.reserved = meta, 0, meta.get("reserved", 0)
+        self.lost = self._lost_slots() if path is not None else np.empty(0, dtype=np.int64)
+        # frame id of the last next state, the state of the following step may repeat it
+        self.next_id = None
+
+        # for N-step Learning
+        self.n_step_buffer = deque(maxlen=n_step)
+        self.n_step = n_step
+        self.gamma = gamma
+
+    def _open_buffers(self, path: str, size: int):
+        """Open the arrays of `size` transitions."""
+        self.obs_idx_buf = open_array(path, "obs_idx", [size], np.int64)
+        if self.window > 1:
+            # id of the first frame of the episode of each transition
+            self.first_idx_buf = open_array(path, "first_idx", [size], np.int64)
+            self.episode_first, self.new_episode = 0, True
+        self.next_obs_idx_buf = open_array(path, "next_obs_idx", [size], np.int64)
+        self.acts_buf = open_array(path, "acts", [size], np.float32)
+        self.rews_buf = open_array(path, "rews", [size], np.float32)
+        self.done_buf = open_array(path, "done", [size], np.float32)
+
+    def store(
+        self,
+        obs: np.ndarray,
+        act: np.ndarray,
+        rew: float,
+        next_obs: np.ndarray,
+        done: bool,
+    ) -> Tuple[int, np.ndarray, float, int, bool]:
+        # frames are added as steps arrive, in episode order
+        obs_idx = self.frames.add(obs, previous=self.next_id)
+        next_idx = obs_idx if done else self.frames.add(next_obs)
+        self.next_id = None if done else next_idx
+        self.n_step_buffer.append((obs_idx, act, rew, next_idx, done))
+
+        # single step transition is not ready
+        if len(self.n_step_buffer) < self.n_step:
+            return ()
+
+        # make a n-step transition
+        if self.n_step > 1:
+            rew, next_idx, done = self._get_n_step_info(
+                self.n_step_buffer, self.gamma
+            )
+        obs_idx, act = self.n_step_buffer[0][:2]
+        self._reserve()
+
+        if self.window > 1:
+            if self.new_episode:
+                self.episode_first = obs_idx
+            self.first_idx_buf[self.ptr] = self.episode_first
+            self.new_episode = bool(self.n_step_buffer[0][-1])
+        self.obs_idx_buf[self.ptr] = obs_idx
+        self.next_obs_idx_buf[self.ptr] = obs_idx if done else next_idx
+        self.acts_buf[self.ptr] = act
+        self.rews_buf[self.ptr] = rew
+        self.done_buf[self.ptr] = done
+        self.ptr = (self.ptr + 1) % self.max_size
+        self.size = min(self.size + 1, self.max_size)
+
+        return self.n_step_buffer[0]
+
+    def sample_batch(self, rng: np.random.RandomState = np.random) -> Dict[str, np.ndarray]:
+        idxs = rng.choice(self.size, size=self.batch_size, replace=False)
+
+        batch = self.sample_batch_from_idxs(idxs)
+        # for N-step Learning
+        batch.update(indices=idxs)
+        return batch
+
+    def sample_batch_from_idxs(
+        self, idxs: np.ndarray, out: Dict[str, np.ndarray] = None
+    ) -> Dict[str, np.ndarray]:
+        """Gather transitions at idxs, into the arrays of `out` if given."""
+        # for N-step Learning
+        out = {} if out is None else out
+        return dict(
+            obs=self._states(self.obs_idx_buf, idxs, out.get("obs")),
+            next_obs=self._states(self.next_obs_idx_buf, idxs, out.get("next_obs")),
+            acts=np.take(self.acts_buf, idxs, out=out.get("acts")),
+            rews=np.take(self.rews_buf, idxs, out=out.get("rews")),
+            done=np.take(self.done_buf, idxs, out=out.get("done")),
+        )
+
+    def sample_n_step(
+        self,
+        idxs: np.ndarray,
+        n_steps: Sequence[int],
+        gamma: float = None,
+        out: Sequence[Dict[str, np.ndarray]] = None,
+    ) -> List[Dict[str, np.ndarray]]:
+        """Returns the n-step next states, returns, dones and discounts of the transitions at idxs.
+
+        There is one batch per horizon in `n_steps`, into the arrays of `out`
+        if given. Returns stop at the end of the episode and at the newest
+        transition, where fewer steps are taken and discounts is the
+        discount of the bootstrapped value, gamma ** steps.
+        """
+        gamma = self.gamma if gamma is None else gamma
+        horizon = max(n_steps)
+        steps = (np.asarray(idxs)[:, None] + np.arange(horizon)) % self.max_size
+        rews = self.rews_buf[steps]
+
+        # a step is taken if every step before it continues into it
+        continues = self.obs_idx_buf[steps[:, 1:]] == self.next_obs_idx_buf[steps[:, :-1]]
+        taken = np.ones(steps.shape, dtype=bool)
+        taken[:, 1:] = np.logical_and.accumulate(continues, axis=1)
+        discounts = (gamma ** np.arange(horizon)).astype(np.float32)
+        returns = np.cumsum(rews * taken * discounts, axis=1)
+
+        batches = []
+        for i, n in enumerate(n_steps):
+            batch_out = {} if out is None else out[i]
+            count = taken[:, :n].sum(axis=1)
+            last = steps[np.arange(len(steps)), count - 1]
+            discounts = (gamma ** count).astype(np.float32)
+            if "discounts" in batch_out:
+                batch_out["discounts"][:] = discounts
+                discounts = batch_out["discounts"]
+            batches.append(dict(
+                next_obs=self._states(self.next_obs_idx_buf, last, batch_out.get("next_obs")),
+                rews=np.take(returns, n - 1, axis=1, out=batch_out.get("rews")),
+                done=np.take(self.done_buf, last, out=batch_out.get("done")),
+                discounts=discounts,
+            ))
+        return batches
+
+    def n_step_shapes(self) -> Dict[str, Tuple[int, ...]]:
+        """Shapes of the arrays of one horizon returned by sample_n_step."""
+        shapes = self.batch_shapes()
+        return dict(
+            next_obs=shapes["next_obs"],
+            rews=shapes["rews"],
+            done=shapes["done"],
+            discounts=(self.batch_size,),
+        )
+
+    def batch_shapes(self) -> Dict[str, Tuple[int, ...]]:
+        """Shapes of the arrays of a sampled batch."""
+        return dict(
+            obs=(self.batch_size, *self.obs_shape),
+            next_obs=(self.batch_size, *self.obs_shape),
+            acts=(self.batch_size,),
+            rews=(self.batch_size,),
+            done=(self.batch_size,),
+        )
+
+    def _states(
+        self, idx_buf: np.ndarray, idxs: np.ndarray, out: np.ndarray = None
+    ) -> np.ndarray:
+        """Gather the states, or windows of states, of idx_buf at idxs."""
+        frame_ids = idx_buf[idxs]
+        if self.window == 1:
+            return self.frames.get(frame_ids, out=out)
+
+        # window of frames ending at each id, clipped to the start of its episode
+        frame_ids = np.maximum(
+            frame_ids[:, None] + np.arange(1 - self.window, 1),
+            self.first_idx_buf[idxs][:, None],
+        )
+        if out is not None:
+            out = out.reshape(len(idxs), self.window, *self.frames.frames.shape[1:])
+        states = self.frames.get(frame_ids, out=out)
+        return states.reshape(len(idxs), *self.obs_shape)
+
+    def _get_n_step_info(
+        self, n_step_buffer: Deque, gamma: float
+    ) -> Tuple[np.int64, np.ndarray, bool]:
+        """Return n step rew, next_obs, and done."""
+        # info of the last transition
+        rew, next_obs, done = n_step_buffer[-1][-3:]
+
+        for transition in reversed(list(n_step_buffer)[:-1]):
+            r, n_o, d = transition[-3:]
+
+            rew = r + gamma * rew * (1 - d)
+            next_obs, done = (n_o, d) if d else (next_obs, done)
+
+        return rew, next_obs, done
+
+    def _meta(self) -> Dict:
+        """Pointers saved with the buffer."""
+        return dict(ptr=self.ptr, size=self.size)
+
+    def _reserve(self):
+        """Record in meta.json that the slot at ptr is written before the next flush."""
+        if self.path is not None and self.unflushed >= self.reserved:
+            self.reserved += reserve_step(self.max_size)
+            save_meta(self.path, dict(self.flushed, reserved=self.reserved))
+        self.unflushed += 1
+
+    def _lost_slots(self) -> np.ndarray:
+        """Reset the slots written after the last flush or with overwritten frames, returns them."""
+        written = (self.ptr + np.arange(min(self.reserved, self.max_size))) % self.max_size
+        # the first frame of a window or sequence is the oldest one read
+        stored = np.arange(self.size)
+        oldest = self.frames.count - self.frames.size
+        overwritten = stored[self.obs_idx_buf[:self.size] - (self.window - 1) < oldest]
+        lost = np.union1d(written, overwritten)
+        self.obs_idx_buf[lost] = -1
+        if np.isin(stored, lost).all():
+            # nothing flushed survived, start over
+            self.ptr = self.size = 0
+        return lost
+
+    def flush(self):
+        """Write arrays and pointers to disk, and own frames if not shared."""
+        if self.own_frames:
+            self.frames.flush()
+        if self.path is not None:
+            for array in vars(self).values():
+                if isinstance(array, np.memmap):
+                    array.flush()
+            self.flushed, self.unflushed, self.reserved = self._meta(), 0, 0
+            save_meta(self.path, self.flushed)
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """Prioritized Replay buffer.
+
+    Attributes:
+        max_priority (float): max priority
+        tree_ptr (int): next index of tree
+        alpha (float): alpha parameter for prioritized replay buffer
+        sum_tree (SumSegmentTree): sum tree for prior
+        min_tree (MinSegmentTree): min tree for min prior to get max weight
+
+    """
+
+    def __init__(
+        self,
+        obs_dim: Tuple[int, ...],
+        size: int,
+        batch_size: int = 32,
+        alpha: float = 0.6,
+        n_step: int = 1,
+        gamma: float = 0.99,
+        frames: FrameBuffer = None,
+        path: str = None,
+        window: int = 1,
+    ):
+        """Initialization."""
+        assert alpha >= 0
+
+        super(PrioritizedReplayBuffer, self).__init__(
+            obs_dim, size, batch_size, n_step, gamma, frames, path, window
+        )
+        meta = load_meta(path)
+        self.max_priority, self.tree_ptr = meta.get("max_priority", 1.0), meta.get("tree_ptr", 0)
+        if len(self) == 0:
+            self.tree_ptr = self.ptr
+        self.alpha = alpha
+
+        # capacity must be positive and a power of 2.
+        tree_capacity = 1
+        while tree_capacity < self.max_size:
+            tree_capacity *= 2
+
+        sum_tree, min_tree = None, None
+        if path is not None:
+            sum_tree = open_array(path, "sum_tree", [2 * tree_capacity], np.float64)
+            min_tree = open_array(path, "min_tree", [2 * tree_capacity], np.float64, float("inf"))
+        self.sum_tree = SumSegmentTree(tree_capacity, sum_tree)
+        self.min_tree = MinSegmentTree(tree_capacity, min_tree)
+
+        # leaves past the flushed transitions and those of lost slots are never sampled
+        stale = np.union1d(np.arange(len(self), tree_capacity), self.lost)
+        if path is not None and len(stale) > 0:
+            self.sum_tree.update(stale, np.zeros(len(stale)))
+            self.min_tree.update(stale, np.full(len(stale), float("inf")))
+
+    def store(
+        self,
+        obs: np.ndarray,
+        act: int,
+        rew: float,
+        next_obs: np.ndarray,
+        done: bool,
+    ) -> Tuple[int, np.ndarray, float, int, bool]:
+        """Store experience and priority, returns the stored transition with frame ids."""
+        transition = super().store(obs, act, rew, next_obs, done)
+
+        if transition:
+            self.sum_tree[self.tree_ptr] = self.max_priority ** self.alpha
+            self.min_tree[self.tree_ptr] = self.max_priority ** self.alpha
+            self.tree_ptr = (self.tree_ptr + 1) % self.max_size
+
+        return transition
+
+    def sample_batch(
+        self,
+        beta: float = 0.4,
+        out: Dict[str, np.ndarray] = None,
+        rng: np.random.RandomState = np.random,
+    ) -> Dict[str, np.ndarray]:
+        """Sample a batch of experiences with `rng`, into the arrays of `out` if given."""
+        assert len(self) >= self.batch_size
+        assert beta > 0
+
+        indices = self._sample_proportional(rng)
+
+        batch = self.sample_batch_from_idxs(indices, out)
+        weights = self._calculate_weights(indices, beta)
+        if out is not None and "weights" in out:
+            out["weights"][:] = weights
+            weights = out["weights"]
+        batch.update(weights=weights, indices=indices)
+
+        return batch
+
+    def update_priorities(self, indices: np.ndarray, priorities: np.ndarray):
+        """Update priorities of sampled transitions."""
+        assert len(indices) == len(priorities)
+        indices = np.asarray(indices)
+        priorities = np.ravel(priorities).astype(np.float64)
+        assert np.all(priorities > 0)
+        assert np.all((0 <= indices) & (indices < len(self)))
+
+        self.sum_tree.update(indices, priorities ** self.alpha)
+        self.min_tree.update(indices, priorities ** self.alpha)
+
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def _sample_proportional(self, rng: np.random.RandomState = np.random) -> np.ndarray:
+        """Sample indices based on proportions."""
+        # leaves past len(self) are empty, so the root holds the total
+        p_total = self.sum_tree.sum()
+        segment = p_total / self.batch_size
+
+        a = segment * np.arange(self.batch_size)
+        b = a + segment
+        upperbounds = rng.uniform(a, b)
+        return self.sum_tree.retrieve(upperbounds)
+
+    def _calculate_weights(self, indices: np.ndarray, beta: float) -> np.ndarray:
+        """Calculate the weights of the experiences at indices."""
+        p_total = self.sum_tree.sum()
+
+        # get max weight
+        p_min = self.min_tree.min() / p_total
+        max_weight = (p_min * len(self)) ** (-beta)
+
+        # calculate weights
+        p_sample = self.sum_tree[indices] / p_total
+        weights = (p_sample * len(self)) ** (-beta)
+        weights = weights / max_weight
+
+        return weights.astype(np.float32)
+
+    def batch_shapes(self) -> Dict[str, Tuple[int, ...]]:
+        """Shapes of the arrays of a sampled batch."""
+        shapes = super().batch_shapes()
+        shapes.update(weights=(self.batch_size,))
+        return shapes
+
+    def _meta(self) -> Dict:
+        """Pointers saved with the buffer."""
+        meta = super()._meta()
+        meta.update(max_priority=float(self.max_priority), tree_ptr=self.tree_ptr)
+        return meta
+
+    def flush(self):
+        """Write arrays, priorities and pointers to disk."""
+        if self.path is not None:
+            self.sum_tree.tree.flush()
+            self.min_tree.tree.flush()
+        super().flush()
+
+
+class SequenceReplayBuffer(PrioritizedReplayBuffer):
+    """Prioritized replay of fixed-length sequences for recurrent agents.
+
+    Steps are stored one at a time with the recurrent state the actor had
+    before the step. A sequence of `seq_len` steps starts every `stride`
+    steps of an episode, so consecutive sequences overlap, and is stored
+    once its steps are known. Sequences cut short by the end of the episode
+    are padded and masked. A sequence keeps the recurrent state of its
+    first step so training can unroll from it, after a burn-in.
+
+    States of a sampled sequence are the `seq_len + 1` frames of its steps
+    and of the state after its last step, frames of an episode have
+    consecutive ids. Steps must be stored in episode order by one actor.
+
+    Attributes:
+        seq_len (int): steps of a sequence
+        stride (int): steps between the starts of consecutive sequences
+        hidden_shape (tuple): shape of the recurrent state of one actor
+        steps (deque): latest steps of the episode not yet stored in full
+
+    """
+
+    def __init__(
+        self,
+        obs_dim: Tuple[int, ...],
+        size: int,
+        hidden_shape: Tuple[int, ...],
+        batch_size: int = 32,
+        alpha: float = 0.6,
+        seq_len: int = 24,
+        stride: int = 8,
+        frames: FrameBuffer = None,
+        path: str = None,
+    ):
+        """Initialization.
+
+        Args:
+            obs_dim (tuple): shape of one state
+            size (int): number of sequences
+            hidden_shape (tuple): shape of the recurrent state of one actor
+            batch_size (int): sequences per batch
+            alpha (float): alpha parameter for prioritized replay buffer
+            seq_len (int): steps of a sequence
+            stride (int): steps between the starts of consecutive sequences
+            frames (FrameBuffer): shared frames, by default the buffer owns
+                enough frames for `size` sequences
+            path (str): directory of the on-disk buffer, None keeps it in RAM
+
+        """
+        assert 0 < stride <= seq_len
+        self.seq_len = seq_len
+        self.stride = stride
+        self.hidden_shape = tuple(hidden_shape)
+        own_frames = frames is None
+        if frames is None:
+            # a sequence starts every stride frames, and every episode adds its terminal frame
+            frames_path = None if path is None else os.path.join(path, "frames")
+            frames = FrameBuffer(obs_dim, size * (stride + 1) + seq_len + 1, path=frames_path)
+
+        super(SequenceReplayBuffer, self).__init__(
+            obs_dim, size, batch_size, alpha, frames=frames, path=path
+        )
+        self.own_frames = own_frames
+        self.steps = deque(maxlen=seq_len + 1)
+        self.episode_steps = 0
+
+    def _open_buffers(self, path: str, size: int):
+        """Open the arrays of `size` sequences."""
+        self.obs_idx_buf = open_array(path, "obs_idx", [size], np.int64)
+        self.len_buf = open_array(path, "len", [size], np.int64)
+        self.acts_buf = open_array(path, "acts", [size, self.seq_len], np.float32)
+        self.rews_buf = open_array(path, "rews", [size, self.seq_len], np.float32)
+        self.done_buf = open_array(path, "done", [size, self.seq_len], np.float32)
+        self.hidden_buf = open_array(path, "hidden", [size, *self.hidden_shape], np.float32)
+
+    def store(
+        self,
+        obs: np.ndarray,
+        act: int,
+        rew: float,
+        next_obs: np.ndarray,
+        done: bool,
+        hidden: np.ndarray = None,
+    ) -> int:
+        """Store a step and the recurrent state before it, returns the number of sequences stored."""
+        if hidden is None:
+            hidden = np.zeros(self.hidden_shape, dtype=np.float32)
+        self.steps.append((self.frames.add(obs), act, rew, done, hidden))
+        self.episode_steps += 1
+        stored = 0
+
+        # the state after the sequence starting seq_len steps ago is the frame just stored
+        start = self.episode_steps - 1 - self.seq_len
+        if start >= 0 and start % self.stride == 0:
+            self._store_sequence(list(self.steps)[:-1])
+            stored += 1
+
+        if done:
+            # the sequences still open end with the episode
+            self.frames.add(next_obs)
+            steps = list(self.steps)
+            first = self.episode_steps - len(steps)
+            for start in range(max(first, self.episode_steps - self.seq_len), self.episode_steps):
+                if start % self.stride == 0:
+                    self._store_sequence(steps[start - first:])
+                    stored += 1
+            self.steps.clear()
+            self.episode_steps = 0
+        return stored
+
+    def _store_sequence(self, steps: List[Tuple]):
+        frame_ids, acts, rews, done, hidden = zip(*steps)
+        length = len(steps)
+        self._reserve()
+        self.obs_idx_buf[self.ptr] = frame_ids[0]
+        self.len_buf[self.ptr] = length
+        self.acts_buf[self.ptr] = 0
+        self.rews_buf[self.ptr] = 0
+        self.done_buf[self.ptr] = 0
+        self.acts_buf[self.ptr, :length] = acts
+        self.rews_buf[self.ptr, :length] = rews
+        self.done_buf[self.ptr, :length] = done
+        self.hidden_buf[self.ptr] = hidden[0]
+        self.ptr = (self.ptr + 1) % self.max_size
+        self.size = min(self.size + 1, self.max_size)
+
+        self.sum_tree[self.tree_ptr] = self.max_priority ** self.alpha
+        self.min_tree[self.tree_ptr] = self.max_priority ** self.alpha
+        self.tree_ptr = (self.tree_ptr + 1) % self.max_size
+
+    def sample_batch_from_idxs(
+        self, idxs: np.ndarray, out: Dict[str, np.ndarray] = None
+    ) -> Dict[str, np.ndarray]:
+        """Gather sequences at idxs, into the arrays of `out` if given."""
+        out = {} if out is None else out
+        lengths = self.len_buf[idxs]
+        steps = np.arange(self.seq_len + 1)
+        # padded steps repeat the state after the last step
+        frame_ids = self.obs_idx_buf[idxs][:, None] + np.minimum(steps, lengths[:, None])
+        mask = (steps[:-1] < lengths[:, None]).astype(np.float32)
+        if "mask" in out:
+            out["mask"][:] = mask
+            mask = out["mask"]
+        return dict(
+            obs=self.frames.get(frame_ids, out=out.get("obs")),
+            acts=np.take(self.acts_buf, idxs, axis=0, out=out.get("acts")),
+            rews=np.take(self.rews_buf, idxs, axis=0, out=out.get("rews")),
+            done=np.take(self.done_buf, idxs, axis=0, out=out.get("done")),
+            mask=mask,
+            hidden=np.take(self.hidden_buf, idxs, axis=0, out=out.get("hidden")),
+        )
+
+    def batch_shapes(self) -> Dict[str, Tuple[int, ...]]:
+        """Shapes of the arrays of a sampled batch."""
+        steps = (self.batch_size, self.seq_len)
+        return dict(
+            obs=(self.batch_size, self.seq_len + 1, *self.obs_shape),
+            acts=steps,
+            rews=steps,
+            done=steps,
+            mask=steps,
+            hidden=(self.batch_size, *self.hidden_shape),
+            weights=(self.batch_size,),
+        )
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 """Segment tree for Prioritized Replay Buffer."""
 
-import operator
-from typing import Callable
+from typing import Sequence, Union
+
+import numpy as np
 
 
 class SegmentTree:
@@ -11,27 +12,37 @@ class SegmentTree:
     Taken from OpenAI baselines github repository:
     https://github.com/openai/baselines/blob/master/baselines/common/segment_tree.py
 
+    The tree is kept in a numpy array and leaves can be updated in batches,
+    `operation` must be a numpy ufunc (np.add, np.minimum).
+
     Attributes:
         capacity (int)
-        tree (list)
-        operation (function)
+        tree (np.ndarray)
+        operation (np.ufunc)
 
     """
 
-    def __init__(self, capacity: int, operation: Callable, init_value: float):
+    def __init__(
+        self, capacity: int, operation: np.ufunc, init_value: float, tree: np.ndarray = None
+    ):
         """Initialization.
 
         Args:
             capacity (int)
-            operation (function)
+            operation (np.ufunc)
             init_value (float)
+            tree (np.ndarray): existing storage of size 2 * capacity, e.g. a memmap
 
         """
         assert (
             capacity > 0 and capacity & (capacity - 1) == 0
         ), "capacity must be positive and a power of 2."
         self.capacity = capacity
-        self.tree = [init_value for _ in range(2 * capacity)]
+        self.depth = capacity.bit_length() - 1
+        if tree is None:
+            tree = np.full(2 * capacity, init_value, dtype=np.float64)
+        assert len(tree) == 2 * capacity
+        self.tree = tree
         self.operation = operation
 
     def _operate_helper(
@@ -54,27 +65,47 @@ class SegmentTree:
 
     def operate(self, start: int = 0, end: int = 0) -> float:
         """Returns result of applying `self.operation`."""
+        if start == 0 and end == 0:
+            return self.tree[1]  # whole tree
         if end <= 0:
             end += self.capacity
         end -= 1
 
         return self._operate_helper(start, end, 1, 0, self.capacity - 1)
 
-    def __setitem__(self, idx: int, val: float):
+    def update(self, indices: Sequence[int], values: Sequence[float]):
+        """Set values of many leaves, then recompute their ancestors level by level."""
+        indices = np.asarray(indices, dtype=np.int64) + self.capacity
+        self.tree[indices] = values
+
+        # sorted neighbouring leaves share their ancestors from the level of the
+        # highest bit they differ in; ordered by that level, the distinct parents
+        # of every level are a prefix, so each shared ancestor is recomputed once
+        leaves = np.unique(indices)
+        merge = np.empty(len(leaves), dtype=np.int64)
+        merge[0] = self.depth + 1
+        merge[1:] = np.frexp((leaves[1:] ^ leaves[:-1]).astype(np.float64))[1]
+        order = np.argsort(-merge, kind="stable")
+        levels = np.arange(1, self.depth + 1)
+        counts = np.searchsorted(-merge[order], -levels).tolist()
+        ancestors = leaves[order] >> levels[:, np.newaxis]
+
+        # row i of the pairs view holds the children 2i and 2i + 1
+        pairs = self.tree.reshape(-1, 2)
+        for parents, count in zip(ancestors, counts):
+            parents = parents[:count]
+            children = pairs.take(parents, axis=0)
+            self.tree.put(parents, self.operation(children[:, 0], children[:, 1]))
+
+    def __setitem__(self, idx: Union[int, Sequence[int]], val: Union[float, Sequence[float]]):
         """Set value in tree."""
-        idx += self.capacity
-        self.tree[idx] = val
-
-        idx //= 2
-        while idx >= 1:
-            self.tree[idx] = self.operation(self.tree[2 * idx], self.tree[2 * idx + 1])
-            idx //= 2
+        self.update(np.atleast_1d(idx), np.atleast_1d(val))
 
-    def __getitem__(self, idx: int) -> float:
+    def __getitem__(self, idx: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
         """Get real value in leaf node of tree."""
-        assert 0 <= idx < self.capacity
+        assert np.all((0 <= idx) & (idx < self.capacity))
 
-        return self.tree[self.capacity + idx]
+        return self.tree[self.capacity + np.asarray(idx)]
 
 
 class SumSegmentTree(SegmentTree):
@@ -85,37 +116,42 @@ class SumSegmentTree(SegmentTree):
 
     """
 
-    def __init__(self, capacity: int):
+    def __init__(self, capacity: int, tree: np.ndarray = None):
         """Initialization.
 
         Args:
             capacity (int)
+            tree (np.ndarray): existing storage, see SegmentTree
 
         """
         super(SumSegmentTree, self).__init__(
-            capacity=capacity, operation=operator.add, init_value=0.0
+            capacity=capacity, operation=np.add, init_value=0.0, tree=tree
         )
 
     def sum(self, start: int = 0, end: int = 0) -> float:
         """Returns arr[start] + ... + arr[end]."""
         return super(SumSegmentTree, self).operate(start, end)
 
-    def retrieve(self, upperbound: float) -> int:
-        """Find the highest index `i` about upper bound in the tree"""
+    def retrieve(self, upperbound: Union[float, np.ndarray]) -> Union[int, np.ndarray]:
+        """Find the highest index `i` about upper bound in the tree.
+
+        Accepts an array of upper bounds and descends for all of them at once.
+        """
         # TODO: Check assert case and fix bug
-        assert 0 <= upperbound <= self.sum() + 1e-5, "upperbound: {}".format(upperbound)
+        assert np.all((0 <= upperbound) & (upperbound <= self.sum() + 1e-5)), \
+            "upperbound: {}".format(upperbound)
 
-        idx = 1
+        upperbound = np.array(upperbound, dtype=np.float64)
+        idx = np.ones(upperbound.shape, dtype=np.int64)
 
-        while idx < self.capacity:  # while non-leaf
-            left = 2 * idx
-            right = left + 1
-            if self.tree[left] > upperbound:
-                idx = 2 * idx
-            else:
-                upperbound -= self.tree[left]
-                idx = right
-        return idx - self.capacity
+        for _ in range(self.depth):  # root to leaves
+            idx <<= 1
+            left_value = self.tree[idx]
+            go_right = left_value <= upperbound
+            np.subtract(upperbound, left_value, out=upperbound, where=go_right)
+            idx += go_right
+        idx = idx - self.capacity
+        return int(idx) if idx.ndim == 0 else idx
 
 
 class MinSegmentTree(SegmentTree):
@@ -126,15 +162,16 @@ class MinSegmentTree(SegmentTree):
 
     """
 
-    def __init__(self, capacity: int):
+    def __init__(self, capacity: int, tree: np.ndarray = None):
         """Initialization.
 
         Args:
             capacity (int)
+            tree (np.ndarray): existing storage, see SegmentTree
 
         """
         super(MinSegmentTree, self).__init__(
-            capacity=capacity, operation=min, init_value=float("inf")
+            capacity=capacity, operation=np.minimum, init_value=float("inf"), tree=tree
         )
 
     def min(self, start: int = 0, end: int = 0) -> float:
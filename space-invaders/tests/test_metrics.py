@@ -0,0 +1,24 @@
+from metrics import MetricsLog, MetricsReader, read_history
+
+
+def test_reopened_log_drops_records_of_a_crash(tmp_path):
+    path = str(tmp_path)
+    log = MetricsLog(path, segment_size=10)
+    for step in range(25):
+        log.log("train", loss=step)
+    log.flush()
+    # records written to disk after the last flush, then the run crashes
+    for step in range(25, 40):
+        log.log("train", loss=step)
+    log.file.flush()
+
+    log = MetricsLog(path, segment_size=10)
+    for step in range(5):
+        log.log("train", loss=100 + step)
+    log.flush()
+
+    reader = MetricsReader(path)
+    reader.poll()
+    assert log.counts["train"] == reader.counts["train"] == 30
+    assert reader.summary("train", "loss").state() == log.summary("train", "loss").state()
+    assert read_history(path)["train"]["loss"] == list(range(25)) + list(range(100, 105))
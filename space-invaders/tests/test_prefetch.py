@@ -0,0 +1,47 @@
+import numpy as np
+
+from prefetch import PrefetchSampler
+from replay_buffer import PrioritizedReplayBuffer
+
+
+def train(sampler, memory, steps):
+    """Store and train like the agents do, returns the indices of every batch."""
+    rng = np.random.RandomState(2)
+    batches = []
+    for step in range(steps):
+        obs = np.full((1, 4, 4), step / 255.0, dtype=np.float32)
+        next_obs = np.full((1, 4, 4), (step + 1) / 255.0, dtype=np.float32)
+        sampler.store(obs, step % 6, float(step), next_obs, False)
+        if len(memory) >= memory.batch_size:
+            _, _, indices = sampler.get()
+            batches.append(indices.copy())
+            sampler.update_priorities(indices, rng.uniform(0.1, 1.0, len(indices)))
+    return batches
+
+
+def test_batches_depend_on_the_seed_only():
+    runs = []
+    for _ in range(2):
+        memory = PrioritizedReplayBuffer((1, 4, 4), 200, batch_size=16)
+        sampler = PrefetchSampler(memory, "cpu", seed=0)
+        runs.append(train(sampler, memory, 150))
+        sampler.close()
+    assert all(np.array_equal(a, b) for a, b in zip(*runs))
+
+
+def test_restored_state_draws_the_pending_batch_again():
+    memory = PrioritizedReplayBuffer((1, 4, 4), 200, batch_size=16)
+    sampler = PrefetchSampler(memory, "cpu", seed=0)
+    for step in range(memory.batch_size):
+        obs = np.full((1, 4, 4), step, dtype=np.float32)
+        sampler.store(obs, 0, 0.0, obs, False)
+    state = sampler.state_dict()
+    _, _, expected = sampler.get()
+    expected = expected.copy()
+    # priorities stay at the max priority of new transitions
+    sampler.update_priorities(expected, np.ones(len(expected)))
+
+    sampler.load_state_dict(state)
+    _, _, indices = sampler.get()
+    sampler.close()
+    assert np.array_equal(indices, expected)
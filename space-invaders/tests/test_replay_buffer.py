@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from replay_buffer import FrameBuffer, PrioritizedReplayBuffer
+
+
+def calculate_weight(memory, idx, beta):
+    """Per-index weight of the experience at idx, as computed before batching."""
+    p_min = memory.min_tree.min() / memory.sum_tree.sum()
+    max_weight = (p_min * len(memory)) ** (-beta)
+    p_sample = memory.sum_tree[idx] / memory.sum_tree.sum()
+    weight = (p_sample * len(memory)) ** (-beta)
+    return weight / max_weight
+
+
+@pytest.fixture
+def memory():
+    rng = np.random.RandomState(0)
+    memory = PrioritizedReplayBuffer((1, 4, 4), 100, batch_size=16, alpha=0.6)
+    obs = rng.randint(0, 255, (1, 4, 4)).astype(np.float32)
+    for step in range(80):
+        next_obs = rng.randint(0, 255, (1, 4, 4)).astype(np.float32)
+        memory.store(obs, rng.randint(4), rng.rand(), next_obs, step % 20 == 19)
+        obs = next_obs
+    indices = np.arange(len(memory))
+    memory.update_priorities(indices, rng.uniform(1e-3, 10.0, len(indices)))
+    return memory
+
+
+@pytest.mark.parametrize("beta", [0.1, 0.4, 0.6, 1.0])
+def test_batched_weights_match_per_index_weights(memory, beta):
+    indices = np.random.RandomState(1).randint(len(memory), size=32)
+    weights = memory._calculate_weights(indices, beta)
+    expected = np.array([calculate_weight(memory, i, beta) for i in indices])
+    assert weights.dtype == np.float32
+    assert np.allclose(weights, expected)
+
+
+def test_sampled_batch_carries_batched_weights(memory):
+    batch = memory.sample_batch(beta=0.5)
+    expected = np.array([calculate_weight(memory, i, 0.5) for i in batch["indices"]])
+    assert np.allclose(batch["weights"], expected)
+
+
+def store_steps(memory, rng, steps):
+    obs = rng.randint(0, 255, (1, 4, 4)).astype(np.uint8)
+    for step in range(steps):
+        next_obs = rng.randint(0, 255, (1, 4, 4)).astype(np.uint8)
+        memory.store(obs, rng.randint(4), rng.rand(), next_obs, step % 20 == 19)
+        obs = next_obs
+
+
+def test_reopened_buffer_drops_slots_written_after_flush(tmp_path):
+    rng = np.random.RandomState(0)
+    memory = PrioritizedReplayBuffer((1, 4, 4), 100, batch_size=16, path=str(tmp_path))
+    store_steps(memory, rng, 250)
+    memory.flush()
+    ptr = memory.ptr
+    # crash after overwriting 30 wrapped slots without a flush
+    store_steps(memory, rng, 30)
+    del memory
+
+    memory = PrioritizedReplayBuffer((1, 4, 4), 100, batch_size=16, path=str(tmp_path))
+    written = (ptr + np.arange(30)) % 100
+    assert len(memory) == 100 and memory.ptr == ptr
+    assert np.isin(written, memory.lost).all()
+    assert np.all(memory.sum_tree[memory.lost] == 0)
+    sampled = np.concatenate([memory.sample_batch(0.4)["indices"] for _ in range(50)])
+    assert not np.isin(sampled, memory.lost).any()
+    # returns of the newest flushed transition stop at the lost slots
+    newest = np.array([(ptr - 1) % 100])
+    assert memory.sample_n_step(newest, [3])[0]["discounts"][0] == np.float32(memory.gamma)
+
+
+def test_rows_of_batched_observations_share_frames(tmp_path):
+    # like a vectorized env, every step returns a new batch and rows are views of it
+    num_envs, steps, length = 2, 60, 12
+    rng = np.random.RandomState(0)
+    frames = FrameBuffer((1, 4, 4), 200)
+    memories = [PrioritizedReplayBuffer((1, 4, 4), 100, batch_size=16, frames=frames) for _ in range(num_envs)]
+    obs = rng.randint(0, 255, (num_envs, 1, 4, 4)) / 255.0
+    for step in range(steps):
+        next_obs = rng.randint(0, 255, (num_envs, 1, 4, 4)) / 255.0
+        done = (step + 1) % length == 0
+        for i, memory in enumerate(memories):
+            memory.store(obs[i], 0, 1.0, next_obs[i], done)
+        obs = next_obs.copy()
+
+    # every step adds its state, the next state of a terminal step is not stored
+    assert len(frames) == num_envs * steps
+    memory = memories[0]
+    indices = np.arange(steps - 3)
+    discounts = memory.sample_n_step(indices, [3])[0]["discounts"]
+    expected = memory.gamma ** np.minimum(3, length - indices % length)
+    assert np.allclose(discounts, expected)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Vectorized environment running several Space Invaders games in one process."""
+
+from typing import Tuple
+
+import numpy as np
+from pygame import Surface
+
+from game_v2 import SpaceInvaders
+
+
+class SpaceInvadersVecEnv:
+    """ Step N independent SpaceInvaders games with a single call.
+
+    Every game draws on its own off-screen surface and keeps its own clock,
+    so games do not interfere with each other. Finished games are reset
+    automatically and their first observation is returned in place of the
+    terminal one.
+
+    No display is needed, but sprite images are only converted for fast
+    blitting if a display mode is set before the first game is created.
+
+    Attributes:
+        num_envs (int)
+        games (list)
+        obs_buf (np.ndarray): stacked observations, shape (N, 3, H, W)
+        last_scores (np.ndarray): score of each game at its last episode end
+
+    """
+
+    def __init__(
+        self,
+        num_envs: int,
+        state_xres: int,
+        state_yres: int,
+        ticks_ref: int,
+        frame_skip: int = 1,
+        screen_size: Tuple[int, int] = (800, 600),
+        seed: int = None,
+    ):
+        """Initialization.
+
+        Args:
+            num_envs (int): number of games
+            state_xres (int): observation width
+            state_yres (int): observation height
+            ticks_ref (int): game time advanced per tick
+            frame_skip (int): game ticks per step, rewards are summed
+            screen_size (tuple): size of each off-screen surface
+            seed (int): game i is seeded with seed + i, None shares the module random
+
+        """
+        assert num_envs > 0
+        self.num_envs = num_envs
+        self.frame_skip = frame_skip
+        self.games = [
+            SpaceInvaders(Surface(screen_size), None, state_xres, state_yres,
+                          ticks_ref, headless=True, seed=None if seed is None else seed + i)
+            for i in range(num_envs)
+        ]
+        self.obs_buf = np.zeros([num_envs, 3, state_yres, state_xres], dtype=np.float32)
+        self.rews_buf = np.zeros([num_envs], dtype=np.float32)
+        self.done_buf = np.zeros([num_envs], dtype=bool)
+        self.last_scores = np.zeros([num_envs], dtype=np.int64)
+
+    def reset(self) -> np.ndarray:
+        """Start a new episode in every game and return the observations."""
+        for i, game in enumerate(self.games):
+            self._reset_game(game)
+            game.get_state(out=self.obs_buf[i])
+        return self.obs_buf.copy()
+
+    def step(self, actions: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Apply one action per game.
+
+        Args:
+            actions (np.ndarray): shape (N,)
+
+        Returns:
+            observations (N, 3, H, W), rewards (N,) and done flags (N,)
+
+        """
+        assert len(actions) == self.num_envs
+        for i, (game, action) in enumerate(zip(self.games, actions)):
+            _, reward, done = game.step(action=int(action), repeat=self.frame_skip, observe=False)
+            self.rews_buf[i] = reward
+            self.done_buf[i] = done
+            if done:
+                self.last_scores[i] = game.score
+                self._reset_game(game)
+            game.get_state(out=self.obs_buf[i])
+        return self.obs_buf.copy(), self.rews_buf.copy(), self.done_buf.copy()
+
+    @staticmethod
+    def _reset_game(game: SpaceInvaders):
+        game.new_game()
+
+    def __len__(self) -> int:
+        return self.num_envs